@@ -0,0 +1,72 @@
+"""Episode indexes
+
+Revision ID: 024732411839
+Revises: dafa7ba15102
+Create Date: 2026-10-17 15:52:08.406127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '024732411839'
+down_revision = 'dafa7ba15102'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+import os
+
+
+_URI_PREFIX = 'file://'
+
+
+def _keep_newest_file(conn, episode_id):
+    """Delete all but the most recently created file of the episode along
+    with their stored files (unless still referred to by another file)
+    """
+    rows = conn.execute(sa.text('SELECT id, uri FROM files WHERE episode_id = :id '
+                                'ORDER BY date_created DESC, id DESC'),
+                        id=episode_id).fetchall()
+    for file_id, uri in rows[1:]:
+        conn.execute(sa.text('DELETE FROM files WHERE id = :id'), id=file_id)
+        if uri is None or not uri.startswith(_URI_PREFIX):
+            continue
+        if conn.execute(sa.text('SELECT COUNT(*) FROM files WHERE uri = :uri'),
+                        uri=uri).scalar():
+            continue
+        try:
+            os.remove(uri[len(_URI_PREFIX):])
+        except OSError:
+            pass
+
+
+def upgrade():
+    # merge duplicate episodes into the earliest so that their identity can be
+    # made unique, moving any downloaded files over to it (keeping only one)
+    conn = op.get_bind()
+    keepers = {}
+    duplicates = []
+    for row in conn.execute(sa.text('SELECT id, podcast_id, title, url, date_published '
+                                    'FROM episodes ORDER BY id')):
+        keeper = keepers.setdefault(tuple(row[1:]), row[0])
+        if keeper != row[0]:
+            duplicates.append((row[0], keeper))
+    for episode_id, keeper in duplicates:
+        conn.execute(sa.text('UPDATE files SET episode_id = :keeper WHERE episode_id = :id'),
+                     keeper=keeper, id=episode_id)
+        conn.execute(sa.text('DELETE FROM downloads WHERE episode_id = :id'), id=episode_id)
+        conn.execute(sa.text('DELETE FROM episodes WHERE id = :id'), id=episode_id)
+    for keeper in set(keeper for _, keeper in duplicates):
+        _keep_newest_file(conn, keeper)
+    op.create_index('ix_episodes_podcast_id_date_published', 'episodes',
+                    ['podcast_id', 'date_published'], unique=False)
+    op.create_index('ix_episodes_identity', 'episodes',
+                    ['podcast_id', 'title', 'url', 'date_published'], unique=True)
+    op.create_index(op.f('ix_files_episode_id'), 'files', ['episode_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_files_episode_id'), table_name='files')
+    op.drop_index('ix_episodes_identity', table_name='episodes')
+    op.drop_index('ix_episodes_podcast_id_date_published', table_name='episodes')
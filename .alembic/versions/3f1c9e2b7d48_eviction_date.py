@@ -0,0 +1,25 @@
+"""Eviction date
+
+Revision ID: 3f1c9e2b7d48
+Revises: 024732411839
+Create Date: 2026-10-17 17:12:44.305918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9e2b7d48'
+down_revision = '024732411839'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('episodes', sa.Column('date_evicted', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('episodes') as batch_op:
+        batch_op.drop_column('date_evicted')
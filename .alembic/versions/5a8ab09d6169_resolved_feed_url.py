@@ -0,0 +1,30 @@
+"""Resolved feed URL cache
+
+Revision ID: 5a8ab09d6169
+Revises: c7c75a6821df
+Create Date: 2026-10-17 10:03:27.554190
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a8ab09d6169'
+down_revision = 'c7c75a6821df'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('podcasts', sa.Column('source_url', sa.String(length=2047), nullable=True))
+    op.add_column('podcasts', sa.Column('redirect_chain', sa.Text(), nullable=True))
+    op.add_column('podcasts', sa.Column('resolved_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute('UPDATE podcasts SET source_url = rss_url')
+
+
+def downgrade():
+    with op.batch_alter_table('podcasts') as batch_op:
+        batch_op.drop_column('resolved_at')
+        batch_op.drop_column('redirect_chain')
+        batch_op.drop_column('source_url')
@@ -0,0 +1,27 @@
+"""Refresh schedule
+
+Revision ID: 69726fdf60f0
+Revises: 5a8ab09d6169
+Create Date: 2026-10-17 11:26:05.913442
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '69726fdf60f0'
+down_revision = '5a8ab09d6169'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('podcasts', sa.Column('next_check', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_podcasts_next_check'), 'podcasts', ['next_check'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_podcasts_next_check'), table_name='podcasts')
+    with op.batch_alter_table('podcasts') as batch_op:
+        batch_op.drop_column('next_check')
@@ -0,0 +1,25 @@
+"""Prefetch count
+
+Revision ID: 95326bb729e9
+Revises: a349604a1d9a
+Create Date: 2026-10-17 12:41:52.630187
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '95326bb729e9'
+down_revision = 'a349604a1d9a'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('podcasts', sa.Column('prefetch_count', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('podcasts') as batch_op:
+        batch_op.drop_column('prefetch_count')
@@ -0,0 +1,33 @@
+"""Download queue
+
+Revision ID: a349604a1d9a
+Revises: 69726fdf60f0
+Create Date: 2026-10-17 12:04:31.208716
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a349604a1d9a'
+down_revision = '69726fdf60f0'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('downloads',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('episode_id', sa.Integer(), nullable=True),
+        sa.Column('priority', sa.Integer(), nullable=True),
+        sa.Column('date_added', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('error', sa.String(length=1024), nullable=True),
+        sa.ForeignKeyConstraint(['episode_id'], ['episodes.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('episode_id')
+    )
+
+
+def downgrade():
+    op.drop_table('downloads')
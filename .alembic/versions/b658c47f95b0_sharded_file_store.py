@@ -0,0 +1,78 @@
+"""Sharded file store
+
+Moves each downloaded episode file from the flat store layout (named by
+`hash(key)`) to the sharded layout (named by the SHA-1 digest of the key)
+and updates its uri.
+
+Revision ID: b658c47f95b0
+Revises: 95326bb729e9
+Create Date: 2026-10-17 14:02:17.551904
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b658c47f95b0'
+down_revision = '95326bb729e9'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+import hashlib
+import os
+import shutil
+
+
+_URI_PREFIX = 'file://'
+
+
+def _flat_fname(key):
+    return str(hash(key))
+
+
+def _sharded_fname(key):
+    digest = hashlib.sha1(key.encode('utf-8') if isinstance(key, unicode) else key).hexdigest()
+    return os.path.join(digest[:2], digest[2:4], digest)
+
+
+def _store_dir(path, old_fname):
+    """Return the store directory of the file at `path` named `old_fname`
+    within it (None if `path` does not end with `old_fname`)
+    """
+    if not path.endswith(os.sep + old_fname):
+        return None
+    return path[:-len(old_fname) - 1]
+
+
+def _rehome(old_fname, new_fname):
+    """Move each episode file named `old_fname(key)` to `new_fname(key)`
+    within its store directory, updating the uris of those moved
+    """
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        'SELECT files.id, files.uri, podcasts.name, episodes.title FROM files '
+        'JOIN episodes ON files.episode_id = episodes.id '
+        'JOIN podcasts ON episodes.podcast_id = podcasts.id')).fetchall()
+    for file_id, uri, podcast_name, episode_title in rows:
+        if uri is None or not uri.startswith(_URI_PREFIX):
+            continue
+        key = ' - '.join((podcast_name, episode_title))
+        path = uri[len(_URI_PREFIX):]
+        store_dir = _store_dir(path, old_fname(key))
+        if store_dir is None or not os.path.exists(path):
+            continue
+        new_path = os.path.join(store_dir, new_fname(key))
+        if not os.path.isdir(os.path.dirname(new_path)):
+            os.makedirs(os.path.dirname(new_path))
+        shutil.move(path, new_path)
+        conn.execute(sa.text('UPDATE files SET uri = :uri WHERE id = :id'),
+                     uri=_URI_PREFIX + new_path, id=file_id)
+
+
+def upgrade():
+    _rehome(_flat_fname, _sharded_fname)
+
+
+def downgrade():
+    _rehome(_sharded_fname, _flat_fname)
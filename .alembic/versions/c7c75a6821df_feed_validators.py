@@ -0,0 +1,27 @@
+"""Feed validators
+
+Revision ID: c7c75a6821df
+Revises: 5688b6adaa40
+Create Date: 2026-10-17 09:12:41.208316
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c7c75a6821df'
+down_revision = '5688b6adaa40'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('podcasts', sa.Column('etag', sa.String(length=255), nullable=True))
+    op.add_column('podcasts', sa.Column('last_modified', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('podcasts') as batch_op:
+        batch_op.drop_column('last_modified')
+        batch_op.drop_column('etag')
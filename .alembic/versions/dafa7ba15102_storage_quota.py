@@ -0,0 +1,40 @@
+"""Storage quota
+
+Revision ID: dafa7ba15102
+Revises: b658c47f95b0
+Create Date: 2026-10-17 14:37:40.118294
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'dafa7ba15102'
+down_revision = 'b658c47f95b0'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+import os
+
+
+_URI_PREFIX = 'file://'
+
+
+def upgrade():
+    op.add_column('episodes', sa.Column('last_played', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('files', sa.Column('size', sa.BigInteger(), nullable=True))
+    # record the sizes of the files already downloaded
+    conn = op.get_bind()
+    for file_id, uri in conn.execute(sa.text('SELECT id, uri FROM files')).fetchall():
+        path = uri[len(_URI_PREFIX):] if uri and uri.startswith(_URI_PREFIX) else None
+        if path is not None and os.path.exists(path):
+            conn.execute(sa.text('UPDATE files SET size = :size WHERE id = :id'),
+                         size=os.path.getsize(path), id=file_id)
+
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('size')
+    with op.batch_alter_table('episodes') as batch_op:
+        batch_op.drop_column('last_played')
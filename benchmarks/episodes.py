@@ -0,0 +1,95 @@
+"""Benchmark listing and refreshing the episodes of a podcast as the number of
+episodes in the database grows (up to a million).
+
+Usage: python -m benchmarks.episodes
+"""
+from podcaster.model import Podcast, Episode
+from podcaster.operations import Controller
+from podcaster.rss import PodcastData
+from tests.utils import TempDir
+
+from datetime import datetime, timedelta
+from time import time
+
+from dateutil.tz import tzutc
+
+
+# the number of episodes of each synthetic podcast
+_EPISODES_PER_PODCAST = 1000
+
+# the number of rows inserted per statement when populating the database
+_INSERT_BATCH = 10000
+
+
+class _View(object):
+    """View collecting the page of episodes listed"""
+    def episodes(self, podcast, episodes, cursors):
+        return list(episodes)
+
+
+def _episode_tuples(num_episodes, offset):
+    base = datetime(2000, 1, 1)
+    return [('http://example.com/%d.mp3' % ind, 'Episode %d' % ind, '',
+                base + timedelta(hours=ind))
+            for ind in xrange(offset, offset + num_episodes)]
+
+
+def _populate(controller, num_episodes):
+    """Add podcasts of `_EPISODES_PER_PODCAST` episodes each totalling
+    `num_episodes` episodes, returning the id of the last
+    """
+    with controller.session() as session:
+        podcasts = [Podcast(name='Bench %d' % ind, rss_url='http://example.com/%d' % ind,
+                            last_updated=datetime(1999, 1, 1))
+                    for ind in xrange(num_episodes // _EPISODES_PER_PODCAST)]
+        session.add_all(podcasts)
+        session.flush()
+        rows = []
+        for podcast in podcasts:
+            rows.extend({'podcast_id': podcast.id, 'title': title, 'url': url,
+                         'date_published': published}
+                        for url, title, _, published in
+                        _episode_tuples(_EPISODES_PER_PODCAST, 0))
+            if len(rows) >= _INSERT_BATCH:
+                session.execute(Episode.__table__.insert(), rows)
+                rows = []
+        if rows:
+            session.execute(Episode.__table__.insert(), rows)
+        return podcasts[-1].id
+
+
+def bench_episodes(num_episodes):
+    """Return a 2-tuple of the form (list_seconds, refresh_seconds) for
+    listing the first page of the episodes of a podcast and for a refresh of
+    it where half of its episodes have changed, with `num_episodes` episodes
+    in the database
+    """
+    controller = Controller()
+    controller.view = _View()
+    podcast_id = _populate(controller, num_episodes)
+    start = time()
+    controller.episodes(podcast_id)
+    list_seconds = time() - start
+    feed = (PodcastData('Bench', 'http://example.com/rss',
+                        datetime.now(tzutc()) + timedelta(days=1), '', '', '', None, None,
+                        ('http://example.com/rss',), None),
+            _episode_tuples(_EPISODES_PER_PODCAST, _EPISODES_PER_PODCAST // 2))
+    with controller.session() as session:
+        podcast = session.query(Podcast).get(podcast_id)
+        start = time()
+        controller._update_podcast(podcast, *feed)
+        session.flush()
+        refresh_seconds = time() - start
+    return (list_seconds, refresh_seconds)
+
+
+def main():
+    print '%10s %10s %10s' % ('episodes', 'list', 'refresh')
+    for num_episodes in (10000, 100000, 1000000):
+        with TempDir():
+            list_seconds, refresh_seconds = bench_episodes(num_episodes)
+        print '%10d %10.4f %10.4f' % (num_episodes, list_seconds, refresh_seconds)
+
+
+if __name__ == '__main__':
+    main()
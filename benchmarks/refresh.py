@@ -0,0 +1,61 @@
+"""Benchmark the number of statements and time taken by a podcast refresh as
+the size of the feed grows.
+
+Usage: python -m benchmarks.refresh
+"""
+from podcaster.model import Podcast
+from podcaster.operations import Controller
+from podcaster.rss import PodcastData
+from tests.utils import TempDir, count_queries
+
+from datetime import datetime, timedelta
+from time import time
+
+from dateutil.tz import tzutc
+
+
+def _feed(num_episodes, offset):
+    """Return a synthetic feed tuple with `num_episodes` hourly episodes
+    starting from the `offset`th hour
+    """
+    base = datetime(2000, 1, 1, tzinfo=tzutc())
+    episodes = [('http://example.com/%d.mp3' % ind, 'Episode %d' % ind, '',
+                    base + timedelta(hours=ind))
+                for ind in xrange(offset, offset + num_episodes)]
+    updated = datetime.now(tzutc()) + timedelta(days=1 + offset)
+    return (PodcastData('Bench', 'http://example.com/rss', updated, '', '', '', None, None,
+                        ('http://example.com/rss',), None),
+            episodes)
+
+
+def bench_refresh(num_episodes):
+    """Return a 2-tuple of the form (num_statements, seconds) for a refresh of
+    a podcast with `num_episodes` episodes where half of them have changed
+    """
+    controller = Controller()
+    with controller.session() as session:
+        podcast = Podcast(name='Bench', rss_url='http://example.com/rss',
+                            last_updated=datetime(1999, 1, 1))
+        session.add(podcast)
+        session.flush()
+        controller._update_podcast(podcast, *_feed(num_episodes, 0))
+    with controller.session() as session:
+        podcast = session.query(Podcast).one()
+        with count_queries(controller._engine) as statements:
+            start = time()
+            controller._update_podcast(podcast, *_feed(num_episodes, num_episodes // 2))
+            session.flush()
+            elapsed = time() - start
+    return (len(statements), elapsed)
+
+
+def main():
+    print '%10s %12s %10s' % ('episodes', 'statements', 'seconds')
+    for num_episodes in (10, 100, 500, 1000, 5000):
+        with TempDir():
+            num_statements, elapsed = bench_refresh(num_episodes)
+        print '%10d %12d %10.4f' % (num_episodes, num_statements, elapsed)
+
+
+if __name__ == '__main__':
+    main()
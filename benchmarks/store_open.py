@@ -0,0 +1,44 @@
+"""Benchmark the time taken to open a file store as the number of values it
+holds grows, with and without validation.
+
+Both grow linearly with the number of values: without validation no file of
+the store is stat'ed or listed, but the whole manifest is still read and
+parsed. Skipping validation only lowers the constant (the cost per value is
+printed alongside).
+
+Usage: python -m benchmarks.store_open
+"""
+from podcaster.store import SimpleFileStore
+from tests.utils import TempDir
+
+from time import time
+
+
+def bench_open(num_values):
+    """Return a 2-tuple of the form (validated_seconds, unvalidated_seconds)
+    for opening a store holding `num_values` values
+    """
+    store = SimpleFileStore('store')
+    for ind in xrange(num_values):
+        store.put('key %d' % ind, 'v')
+    store.save()
+    start = time()
+    SimpleFileStore('store')
+    validated = time() - start
+    start = time()
+    SimpleFileStore('store', validate=False)
+    unvalidated = time() - start
+    return (validated, unvalidated)
+
+
+def main():
+    print '%10s %12s %12s %12s' % ('values', 'validated', 'unvalidated', 'us/value')
+    for num_values in (10, 100, 1000, 10000):
+        with TempDir():
+            validated, unvalidated = bench_open(num_values)
+        print '%10d %12.4f %12.4f %12.2f' % (num_values, validated, unvalidated,
+                                             1e6 * unvalidated / num_values)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,36 @@
 #!/usr/bin/env python
 from podcaster.operations import Controller
 
+import atexit
 import os
+import signal
+import sys
 
 
 class Podcaster(object):
     def __init__(self):
         self.controller = Controller('.podcaster.db')
+        # save the playback positions still buffered
+        atexit.register(self.controller.save_episode_state)
 
     def run(self):
-        self.controller.update_podcasts(lambda: None)
+        self.controller.update_podcasts_async()
+        self.controller.resume_downloads()
         current_menu = self.controller.all_podcasts
         while current_menu is not None:
             print
             current_menu = current_menu()
 
+
+def _exit_on_signal(signum, frame):
+    """Exit normally (running the exit handlers, e.g. to save buffered
+    playback positions) when terminated
+    """
+    sys.exit(128 + signum)
+
+
 if __name__ == '__main__':
     os.environ.setdefault('VLC_PLUGIN_PATH', '/Applications/VLC.app/Contents/MacOS/plugins/')
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, _exit_on_signal)
     Podcaster().run()
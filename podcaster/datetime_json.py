@@ -4,6 +4,23 @@ import json
 from datetime import datetime
 
 from dateutil import parser
+from dateutil.tz import tzutc
+
+
+def _parse_iso(value):
+    """Return the datetime encoded by `datetime.isoformat` as `value`
+
+    The naive and UTC forms written by `DatetimeEncoder` are parsed directly
+    as `dateutil.parser` is comparatively slow. Other forms fall back to it.
+    """
+    base, tzinfo = value, None
+    if value.endswith('+00:00'):
+        base, tzinfo = value[:-6], tzutc()
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in base else '%Y-%m-%dT%H:%M:%S'
+    try:
+        return datetime.strptime(base, fmt).replace(tzinfo=tzinfo)
+    except ValueError:
+        return parser.parse(value)
 
 
 class DatetimeDecoder(json.JSONDecoder):
@@ -32,7 +49,7 @@ class DatetimeDecoder(json.JSONDecoder):
         Else, pass `dict_` to the object_hook.
         """
         if isinstance(obj, dict) and u'__datetime__' in obj:
-            return parser.parse(obj[u'ISO-8601'])
+            return _parse_iso(obj[u'ISO-8601'])
         return obj
 
 
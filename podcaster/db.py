@@ -0,0 +1,51 @@
+"""SQLite engine configuration
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+# The pragmas applied to each new connection (see https://sqlite.org/pragma.html)
+PRAGMAS = (
+    # let readers proceed while a write is in progress (file databases only)
+    ('journal_mode', 'WAL'),
+    # in WAL mode, a crash may lose the last commits but never corrupts the db
+    ('synchronous', 'NORMAL'),
+    # the number of bytes of the database file to memory-map
+    ('mmap_size', 64 * 1024 * 1024),
+    # the page cache size (negative values are in KiB)
+    ('cache_size', -16 * 1024),
+    # the number of milliseconds to retry for a lock held by another connection
+    ('busy_timeout', 5000),
+)
+
+
+def _apply_pragmas(pragmas):
+    """Return a connect event listener executing each pragma of `pragmas`
+    """
+    def on_connect(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+    return on_connect
+
+
+def sqlite_engine(db_fname=None, pragmas=PRAGMAS):
+    """Return an engine for the sqlite database `db_fname` (in-memory if None)
+    whose connections are configured with `pragmas`
+
+    Connections are shared between threads and configured the same way
+    whichever kind of database it is. Connections to a file database are
+    pooled (rather than opened afresh for each session as is the default) so
+    that the pragmas are only applied once per connection. An in-memory
+    database only exists for as long as its connection, so all threads share
+    a single connection to it.
+    """
+    if db_fname is None:
+        url, poolclass = 'sqlite://', StaticPool
+    else:
+        url, poolclass = 'sqlite:///' + db_fname, QueuePool
+    engine = create_engine(url, echo=False, poolclass=poolclass,
+                           connect_args={'check_same_thread': False})
+    event.listen(engine, 'connect', _apply_pragmas(pragmas))
+    return engine
@@ -0,0 +1,240 @@
+"""Prioritized queue of episode downloads run by a pool of worker threads
+"""
+from collections import defaultdict
+from datetime import datetime
+import heapq
+import itertools
+from urlparse import urlparse
+import threading
+
+
+# Download priorities (lower values are downloaded first)
+PRIORITY_PLAY = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BACKFILL = 2
+
+_QUEUED, _ACTIVE, _DONE = range(3)
+
+# The number of seconds between checks for the opening of the backfill window
+_WINDOW_POLL = 60
+
+
+def in_window(window, now=None):
+    """Return whether the local time `now` (the current time if None) falls
+    within `window`, a 2-tuple of `datetime.time` of the form (start, end)
+    which wraps past midnight if `end` precedes `start`. None is always open.
+    """
+    if window is None:
+        return True
+    time_ = (now or datetime.now()).time()
+    start, end = window
+    if start <= end:
+        return start <= time_ < end
+    return time_ >= start or time_ < end
+
+
+class DownloadTicket(object):
+    """Handle to the queued download of an episode
+
+    The progress of the download is reported to each registered callback
+    following the `cb_progress` contract of `Controller.download_episode`.
+    """
+    def __init__(self, episode_id, url, priority):
+        self.episode_id = episode_id
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.priority = priority
+        self.error = None
+        self.progress = None
+        self._state = _QUEUED
+        self._callbacks = []
+        self._done = threading.Event()
+
+    def add_callback(self, cb_progress):
+        """Register `cb_progress` to be called with the progress of the download
+        """
+        if cb_progress is not None:
+            self._callbacks.append(cb_progress)
+
+    def report(self, ratio):
+        self.progress = ratio
+        for callback in list(self._callbacks):
+            callback(ratio)
+
+    def is_started(self):
+        return self._state != _QUEUED
+
+    def is_done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the download has finished (or `timeout` seconds have passed)
+
+        Returns:
+            On success: None
+            On failure: An error string
+        """
+        self._done.wait(timeout)
+        return self.error
+
+    def _finish(self, error):
+        self.error = error
+        self._state = _DONE
+        self._done.set()
+
+
+class DownloadManager(object):
+    """Run queued downloads on a pool of worker threads
+
+    Queued downloads are started in order of priority (then of submission)
+    subject to a limit on the number of concurrent downloads per host.
+    Downloads with `PRIORITY_PLAY` are started immediately on a thread of
+    their own so that they never wait behind background downloads, while
+    those with `PRIORITY_BACKFILL` are only started within the backfill
+    window.
+    """
+    def __init__(self, download, workers=2, per_host=2, backfill_window=None):
+        """
+        Args:
+            download: The function performing a download, called on a worker
+                thread as `download(episode_id, cb_progress, priority)` and
+                returning an error string on failure (see
+                `Controller.download_episode`)
+            workers: The number of worker threads running background downloads
+            per_host: The maximum number of background downloads from a single
+                host at once
+            backfill_window: The time of day during which backfill downloads
+                may be started (see `in_window`; always if None)
+        """
+        self._download = download
+        self._workers = workers
+        self._per_host = per_host
+        self.backfill_window = backfill_window
+        self._cond = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._tickets = {}
+        self._active_hosts = defaultdict(int)
+        self._threads = []
+        self._stopped = False
+
+    def enqueue(self, episode_id, url, priority=PRIORITY_BACKFILL, cb_progress=None):
+        """Queue the download of an episode
+
+        If the episode is already queued its priority is raised to `priority`
+        (if higher) and the existing ticket is returned.
+
+        Returns:
+            The `DownloadTicket` for the episode's download
+        """
+        with self._cond:
+            ticket = self._tickets.get(episode_id)
+            if ticket is None:
+                ticket = DownloadTicket(episode_id, url, priority)
+                self._tickets[episode_id] = ticket
+                self._push(ticket)
+            elif priority < ticket.priority and ticket._state == _QUEUED:
+                ticket.priority = priority
+                self._push(ticket)
+            ticket.add_callback(cb_progress)
+            if ticket.priority == PRIORITY_PLAY and ticket._state == _QUEUED:
+                ticket._state = _ACTIVE
+                self._spawn(self._run, ticket)
+            else:
+                self._start()
+            self._cond.notify_all()
+        return ticket
+
+    def ticket(self, episode_id):
+        """Return the ticket of an unfinished download of the episode (None if
+        there is none)
+        """
+        with self._cond:
+            return self._tickets.get(episode_id)
+
+    def pending(self):
+        """Return the tickets of all unfinished downloads in priority order
+        """
+        with self._cond:
+            return sorted(self._tickets.itervalues(), key=lambda t: t.priority)
+
+    def stop(self):
+        """Stop the workers once their current downloads have finished
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _push(self, ticket):
+        # superseded entries are skipped when popped (see `_next`)
+        heapq.heappush(self._heap, (ticket.priority, next(self._counter), ticket))
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _start(self):
+        """Start the worker threads if they are not already running
+        """
+        if not self._threads:
+            self._stopped = False
+            self._threads = [self._spawn(self._work) for _ in xrange(self._workers)]
+
+    def _next(self):
+        """Block until a queued download may be started and return its ticket
+        (None once stopped)
+        """
+        with self._cond:
+            while not self._stopped:
+                deferred = []
+                ticket = None
+                backfill_open = in_window(self.backfill_window)
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    candidate = entry[2]
+                    if candidate._state != _QUEUED or candidate.priority != entry[0]:
+                        continue
+                    if self._active_hosts[candidate.host] >= self._per_host or \
+                            (candidate.priority == PRIORITY_BACKFILL and not backfill_open):
+                        deferred.append(entry)
+                        continue
+                    ticket = candidate
+                    break
+                for entry in deferred:
+                    heapq.heappush(self._heap, entry)
+                if ticket is not None:
+                    ticket._state = _ACTIVE
+                    self._active_hosts[ticket.host] += 1
+                    return ticket
+                # wake periodically while backfill waits on its window to open
+                self._cond.wait(_WINDOW_POLL if deferred and not backfill_open else None)
+            return None
+
+    def _work(self):
+        while True:
+            ticket = self._next()
+            if ticket is None:
+                return
+            try:
+                self._run(ticket)
+            finally:
+                with self._cond:
+                    self._active_hosts[ticket.host] -= 1
+                    self._cond.notify_all()
+
+    def _run(self, ticket):
+        error = 'Download failed'
+        try:
+            error = self._download(ticket.episode_id, ticket.report, ticket.priority)
+        except Exception as err:
+            # keep the worker alive for the rest of the queue
+            error = str(err)
+        finally:
+            with self._cond:
+                del self._tickets[ticket.episode_id]
+            ticket._finish(error)
@@ -1,9 +1,18 @@
 """Provide an interface for interaction with URLs and HTTP pages
 """
+import httplib
+import json
+import os
 import socket
-from urllib import urlretrieve
+import threading
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from email.utils import parsedate_tz, mktime_tz
+from tempfile import mkstemp
+from time import time, sleep
 from urllib2 import urlopen, HTTPError, URLError
-from urlparse import urlparse
+from urlparse import urlparse, urljoin
 
 from bs4 import BeautifulSoup
 
@@ -22,24 +31,671 @@ class ResponseError(Exception):
     pass
 
 
-def set_global_timeout(timeout=5):
-    """Set the global timeout for the underlying sockets used by urllib
+Response = namedtuple('Response', ('url', 'status', 'headers', 'body', 'redirects'))
+"""The result of fetching a URL: the final (post-redirect) url, the HTTP
+status, a dict of lower-cased response headers, the response body and the
+urls redirected from on the way to the final url (in the order requested)
+"""
+
+
+# Errors raised by httplib when a connection fails or is dropped
+_TRANSPORT_ERRORS = (socket.error, httplib.HTTPException)
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+_CHUNK_SIZE = 8192
+
+# The smallest byte range worth fetching on a connection of its own
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+
+class _Stream(object):
+    """A response whose body is read incrementally
+
+    url - the final (post-redirect) url
+    status - the HTTP status code
+    headers - a dict of lower-cased response headers
+    redirects - the urls redirected from on the way to `url`
+    """
+    def __init__(self, url, response, redirects=()):
+        self.url = url
+        self.redirects = tuple(redirects)
+        self.status = response.status
+        self.headers = dict(response.getheaders())
+        self._response = response
+
+    def read(self, amt=None):
+        """Return up to `amt` bytes of the body (all remaining if None)
+
+        Raises:
+            ResponseError: If the connection fails mid-body
+        """
+        try:
+            return self._response.read(amt)
+        except _TRANSPORT_ERRORS as err:
+            raise ResponseError('Error during download: %s' % err)
+
+    def is_complete(self):
+        """Return whether the body has been read in its entirety
+        """
+        return self._response.isclosed()
+
+
+# The bandwidth budgets of `BandwidthLimiter`
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class TokenBucket(object):
+    """Limit the rate at which bytes are transferred, shared across threads
+
+    Tokens (bytes) accrue at `rate` per second up to `burst`. A transfer that
+    takes more tokens than are available goes into debt and sleeps until the
+    debt is repaid, so concurrent transfers share the rate between them.
+
+    rate - the sustained rate in bytes per second (unlimited if None)
+    burst - the maximum number of bytes transferred without delay (one
+        second's worth if None)
+    """
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst if burst is not None else max(rate or 0, _CHUNK_SIZE)
+            self._tokens = self.burst
+            self._updated = time()
+
+    def consume(self, amount):
+        """Take `amount` tokens, sleeping until the rate allows it
+        """
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / float(self.rate)
+        if delay > 0:
+            sleep(delay)
+
+
+class BandwidthLimiter(object):
+    """The `TokenBucket` of each bandwidth budget, so that downloads started
+    by the user (`INTERACTIVE`) are limited separately from those running in
+    the background (`BACKGROUND`)
+    """
+    def __init__(self):
+        self._buckets = {INTERACTIVE: TokenBucket(), BACKGROUND: TokenBucket()}
+
+    def bucket(self, budget):
+        return self._buckets[budget]
+
+    def set_rate(self, budget, rate, burst=None):
+        """Limit the downloads of `budget` to `rate` bytes per second (no
+        limit if None)
+        """
+        self._buckets[budget].set_rate(rate, burst)
+
+
+class HTTPClient(object):
+    """An HTTP/1.1 client which keeps connections alive for reuse.
+
+    Idle connections are pooled per (scheme, host, port) so that consecutive
+    requests to the same host (from any thread) skip the TCP and TLS
+    handshakes.
+
+    timeout - number of seconds after which a connection attempt or read
+        should timeout
+    max_idle - the maximum number of idle connections kept per host
+    max_redirects - the maximum number of redirects followed per request
+    """
+    USER_AGENT = 'podcaster'
+
+    def __init__(self, timeout=5, max_idle=4, max_redirects=5):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key):
+        """Return an idle connection for `key` if one exists. Else, a new one.
+
+        Returns:
+            A 2-tuple of the form (connection, is_reused)
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return (idle.pop(), True)
+        scheme, host, port = key
+        conn_cls = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        return (conn_cls(host, port, timeout=self.timeout), False)
+
+    def _release(self, key, conn, response):
+        """Return `conn` to the pool if `response` left it reusable. Else, close it.
+        """
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+    @staticmethod
+    def _key(url):
+        """Return the 2-tuple of the form (pool_key, request_path) for `url`
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ResponseError('unknown url type: %s' % url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        return ((parsed.scheme, parsed.hostname, port), path)
+
+    def _send(self, key, path, headers):
+        """Send a GET request for `path` on a connection for `key`, retrying
+        once on a fresh connection if a pooled one turns out to be stale.
+
+        Returns:
+            A 2-tuple of the form (connection, httplib.HTTPResponse)
+        """
+        while True:
+            conn, is_reused = self._connect(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                return (conn, conn.getresponse())
+            except _TRANSPORT_ERRORS:
+                conn.close()
+                if not is_reused:
+                    raise
+
+    def _open(self, url, headers):
+        """Issue a GET for `url`, following redirects.
+
+        Returns:
+            A 5-tuple of the form (final_url, redirects, pool_key, connection,
+            response) where `redirects` lists the urls redirected from and
+            the body of `response` has not been read
+
+        Raises:
+            ConnectionError: If no internet connection detected
+            ResponseError: If an error occurs in another process
+        """
+        request_headers = {'User-Agent': HTTPClient.USER_AGENT}
+        request_headers.update(headers or {})
+        redirects = []
+        for _ in xrange(self.max_redirects + 1):
+            key, path = HTTPClient._key(url)
+            try:
+                conn, response = self._send(key, path, request_headers)
+            except _TRANSPORT_ERRORS as err:
+                if not test_connection():
+                    raise ConnectionError('No connection')
+                raise ResponseError(str(err))
+            connectivity.report_online()
+            location = response.getheader('location')
+            if response.status not in _REDIRECT_CODES or location is None:
+                return (url, redirects, key, conn, response)
+            # drain the redirect body so the connection can be reused
+            response.read()
+            self._release(key, conn, response)
+            redirects.append(url)
+            url = urljoin(url, location)
+        raise ResponseError('Too many redirects')
+
+    @contextmanager
+    def stream(self, url, headers=None):
+        """Context for a `_Stream` over the body of `url`
+
+        NOTE: The connection is only returned to the pool if the body is read
+            in its entirety.
+
+        Args:
+            url: The URL to be retrieved
+            headers: An optional dict of request headers
+
+        Raises:
+            ConnectionError: If no internet connection detected
+            ResponseError: If the server responds with an error status
+        """
+        url, redirects, key, conn, response = self._open(url, headers)
+        try:
+            if response.status >= 400:
+                raise ResponseError('HTTP Error %d: %s' % (response.status, response.reason))
+            yield _Stream(url, response, redirects)
+        finally:
+            self._release(key, conn, response)
+
+    def fetch(self, url, headers=None):
+        """Return a `Response` for the contents of `url`
+
+        The body is requested with, and decoded from, gzip or deflate content
+        encoding. A 304 (Not Modified) reply to a conditional request is
+        returned as a `Response` with an empty body rather than raised.
+
+        Args:
+            url: The URL to be fetched
+            headers: An optional dict of request headers
+
+        Raises:
+            ConnectionError: If no internet connection detected
+            ResponseError: If an error occurs in another process
+        """
+        request_headers = {'Accept-Encoding': 'gzip, deflate'}
+        request_headers.update(headers or {})
+        with self.stream(url, request_headers) as stream:
+            body = stream.read()
+        response_headers = dict(stream.headers)
+        encoding = response_headers.pop('content-encoding', 'identity').strip().lower()
+        try:
+            if encoding == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            elif encoding == 'deflate':
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    # Some servers send a raw deflate stream without the zlib wrapper
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+        except zlib.error as err:
+            raise ResponseError('Failed to decode response: %s' % err)
+        return Response(stream.url, stream.status, response_headers, body, stream.redirects)
+
+    def download_to_file(self, url, fname=None, reporthook=None, resume=False, segments=1,
+                         budget=INTERACTIVE):
+        """Download the contents of `url` to a file
+
+        Args:
+            url: The URL to be downloaded
+            fname: The path of the file to be written (a temporary file if None)
+            reporthook: An optional function called after each block is
+                written with the arguments (block_num, block_size, total_size)
+                as in `urllib.urlretrieve`. `total_size` is -1 if unknown.
+            resume: If True, a partial download of `url` left at `fname` by a
+                previous failed attempt is continued with a Range request
+                (validated with If-Range) instead of being restarted. The
+                validators are kept in a sidecar file (see `discard_download`)
+                until the download completes.
+            segments: If greater than 1 and the server advertises byte range
+                support (with a validator), a fresh download of at least
+                `MIN_SEGMENT_SIZE` bytes per segment is split into this many
+                byte ranges fetched concurrently and written in place.
+                Otherwise the body is downloaded as a single stream.
+                NOTE: A failed segmented download is restarted (not resumed)
+            budget: The budget of `bandwidth` whose rate limit applies to the
+                download (`INTERACTIVE` or `BACKGROUND`)
+
+        Returns:
+            A 2-tuple of the form (fname, response_headers)
+
+        Raises:
+            ConnectionError: If no internet connection detected
+            ResponseError: If the server responds with an error or the length
+                of the download does not match the length advertised
+        """
+        if fname is None:
+            fd, fname = mkstemp()
+            os.close(fd)
+        state = _load_resume_state(fname, url) if resume else None
+        offset = os.path.getsize(fname) if state is not None else 0
+        headers = {}
+        if offset:
+            if offset == state['length']:
+                _remove_if_exists(fname + RESUME_SUFFIX)
+                return (fname, {})
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = state['validator']
+        bucket = bandwidth.bucket(budget)
+        with self.stream(url, headers) as stream:
+            total_size = int(stream.headers.get('content-length', -1))
+            if stream.status == 206:
+                start, total_size = _content_range(stream.headers.get('content-range', ''))
+                if start != offset:
+                    raise ResponseError('Server resumed download at byte %s instead of %d' %
+                                        (start, offset))
+            else:
+                # the server sent the entire body (e.g. the validator changed)
+                offset = 0
+            if segments > 1 and _can_segment(stream, total_size, segments):
+                _remove_if_exists(fname + RESUME_SUFFIX)
+                size = self._download_segments(stream, fname, total_size, segments,
+                                               reporthook, bucket)
+            else:
+                if resume:
+                    _save_resume_state(fname, url, stream.headers, total_size)
+                size = _write_stream(stream, fname, offset, total_size, reporthook, bucket)
+        if total_size != -1 and size != total_size:
+            raise ResponseError('Download incomplete: received %d of %d bytes' %
+                                (size, total_size))
+        _remove_if_exists(fname + RESUME_SUFFIX)
+        return (fname, stream.headers)
+
+    def _download_segments(self, stream, fname, total_size, segments, reporthook, bucket):
+        """Download the body of `stream` to `fname` as `segments` byte ranges
+        written in place, the first being read from `stream` itself and the
+        rest fetched concurrently on connections of their own.
+
+        Returns:
+            The number of bytes written
+        """
+        length = -(-total_size // segments)
+        ranges = [(start, min(length, total_size - start))
+                    for start in xrange(0, total_size, length)]
+        # pre-allocate the file so that each segment is written at its offset
+        with open(fname, 'wb') as file_:
+            file_.truncate(total_size)
+        progress = _SegmentProgress(total_size, reporthook)
+        errors = []
+        def fetch(start, length):
+            """Fetch a single (non-initial) range, recording any error"""
+            headers = {'Range': 'bytes=%d-%d' % (start, start + length - 1),
+                       'If-Range': _validator(stream.headers)}
+            try:
+                with self.stream(stream.url, headers) as range_stream:
+                    if range_stream.status != 206 or _content_range(
+                            range_stream.headers.get('content-range', ''))[0] != start:
+                        raise ResponseError('Server ignored the range request at byte %d'
+                                            % start)
+                    _write_range(range_stream, fname, start, length, progress, bucket)
+            except (ConnectionError, ResponseError) as err:
+                progress.abort()
+                errors.append(err)
+        threads = [threading.Thread(target=fetch, args=range_) for range_ in ranges[1:]]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            _write_range(stream, fname, ranges[0][0], ranges[0][1], progress, bucket)
+        except ResponseError as err:
+            progress.abort()
+            errors.append(err)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return progress.received
+
+
+class _SegmentProgress(object):
+    """Thread-safe count of the bytes received by a segmented download,
+    reported through a `reporthook` (with a block size of 1)
+    """
+    def __init__(self, total_size, reporthook=None):
+        self.total_size = total_size
+        self.received = 0
+        self.aborted = False
+        self._reporthook = reporthook
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.received += size
+            if self._reporthook is not None:
+                self._reporthook(self.received, 1, self.total_size)
+
+    def abort(self):
+        """Signal the other segments to stop"""
+        self.aborted = True
+
+
+def _validator(headers):
+    """Return the strong validator (ETag or Last-Modified) of the response
+    `headers` (None if there is none)
+    """
+    etag = headers.get('etag')
+    # weak validators cannot be used with If-Range
+    if etag is not None and etag.startswith('W/'):
+        etag = None
+    return etag or headers.get('last-modified')
+
+
+def _can_segment(stream, total_size, segments):
+    """Return whether the body of `stream` may be downloaded in `segments`
+    concurrent byte ranges
+    """
+    return stream.status == 200 \
+            and stream.headers.get('accept-ranges', '').strip().lower() == 'bytes' \
+            and 'content-encoding' not in stream.headers \
+            and _validator(stream.headers) is not None \
+            and total_size >= segments * MIN_SEGMENT_SIZE
+
+
+def _write_stream(stream, fname, offset, total_size, reporthook, bucket):
+    """Write the body of `stream` to `fname`, appending if `offset` is non-zero,
+    at the rate allowed by the `TokenBucket` `bucket`
+
+    Returns:
+        The size of the file
+    """
+    block_num = offset // _CHUNK_SIZE
+    with open(fname, 'ab' if offset else 'wb') as file_:
+        # report once the file is open so that readers never see stale data
+        if reporthook is not None:
+            reporthook(block_num, _CHUNK_SIZE, total_size)
+        while True:
+            block = stream.read(_CHUNK_SIZE)
+            if not block:
+                break
+            bucket.consume(len(block))
+            file_.write(block)
+            block_num += 1
+            if reporthook is not None:
+                reporthook(block_num, _CHUNK_SIZE, total_size)
+        return file_.tell()
+
+
+def _write_range(stream, fname, start, length, progress, bucket):
+    """Write the first `length` bytes of `stream` into `fname` at `start`, at
+    the rate allowed by the `TokenBucket` `bucket`
+
+    Raises:
+        ResponseError: If the stream ends early or the download is aborted
+    """
+    with open(fname, 'r+b') as file_:
+        file_.seek(start)
+        while length > 0:
+            if progress.aborted:
+                raise ResponseError('Download aborted')
+            block = stream.read(min(_CHUNK_SIZE, length))
+            if not block:
+                raise ResponseError('Download incomplete: segment at byte %d ended %d bytes '
+                                    'short' % (start, length))
+            bucket.consume(len(block))
+            file_.write(block)
+            length -= len(block)
+            progress.add(len(block))
+
+
+RESUME_SUFFIX = '.resume'
+"""The suffix of the sidecar file holding the state of a resumable download"""
+
+
+def _remove_if_exists(path):
+    """Remove the file at `path` if it exists
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _content_range(value):
+    """Return the 2-tuple of the form (first_byte, total_size) of the
+    Content-Range header `value` (`total_size` is -1 if unknown)
+
+    Raises:
+        ResponseError: If `value` is malformed
+    """
+    try:
+        _, _, range_ = value.strip().partition(' ')
+        span, _, total = range_.partition('/')
+        return (int(span.split('-')[0]), int(total) if total != '*' else -1)
+    except ValueError:
+        raise ResponseError('Malformed Content-Range: %s' % value)
+
+
+def _load_resume_state(fname, url):
+    """Return the resume state saved for a download of `url` to `fname` if
+    the partial file exists and has a validator. Else, None.
+    """
+    try:
+        with open(fname + RESUME_SUFFIX) as state_file:
+            state = json.load(state_file)
+    except (IOError, ValueError):
+        return None
+    if state.get('url') != url or not state.get('validator') or not os.path.exists(fname):
+        return None
+    return state
+
+
+def _save_resume_state(fname, url, headers, total_size):
+    """Save the state needed to resume the download of `url` to `fname`
+    """
+    state = {'url': url, 'validator': _validator(headers), 'length': total_size}
+    with open(fname + RESUME_SUFFIX, 'w') as state_file:
+        json.dump(state, state_file)
+
+
+def download_length(fname):
+    """Return the length advertised for the resumable download in progress
+    to `fname` (None if unknown)
+    """
+    try:
+        with open(fname + RESUME_SUFFIX) as state_file:
+            length = json.load(state_file).get('length', -1)
+    except (IOError, ValueError):
+        return None
+    return length if length != -1 else None
+
+
+def discard_download(fname):
+    """Remove the (partial) download at `fname` along with any resume state
+    """
+    _remove_if_exists(fname)
+    _remove_if_exists(fname + RESUME_SUFFIX)
+
+
+class ConnectivityMonitor(object):
+    """Track whether the internet connection is up.
+
+    The connection is probed by requesting `probe_url` and the result is cached
+    for `ttl` seconds so that a burst of failed requests results in a single
+    probe. `offline` reflects the result of the last probe.
+
+    probe_url - the URL requested to test the connection
+    ttl - number of seconds for which a probe result is reused
+    timeout - number of seconds after which the probe should timeout
+    """
+    def __init__(self, probe_url='http://www.google.com', ttl=30, timeout=5):
+        self.probe_url = probe_url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.offline = False
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _probe(self):
+        """Return whether `probe_url` can be retrieved
+        """
+        try:
+            urlopen(self.probe_url, timeout=self.timeout).close()
+        except (HTTPError, URLError, socket.error):
+            return False
+        else:
+            return True
+
+    def is_online(self):
+        """Return whether the internet connection is up, probing it if the
+        cached result has expired.
+        """
+        # Hold the lock while probing so concurrent callers share one probe
+        with self._lock:
+            if self._checked_at is None or time() - self._checked_at > self.ttl:
+                self.offline = not self._probe()
+                self._checked_at = time()
+            return not self.offline
+
+    def report_online(self):
+        """Record that a request just succeeded (i.e. the connection is up)
+        """
+        if self.offline or self._checked_at is None:
+            with self._lock:
+                self.offline = False
+                self._checked_at = time()
+
+    def invalidate(self):
+        """Discard the cached result so that the next check probes again
+        """
+        with self._lock:
+            self._checked_at = None
+
+
+connectivity = ConnectivityMonitor()
+"""The monitor consulted by `test_connection`"""
+
+
+default_client = HTTPClient()
+"""The client shared by the module-level functions"""
+
+
+bandwidth = BandwidthLimiter()
+"""The limiter shared by all downloads"""
+
+
+def set_default_timeout(timeout=5):
+    """Set the timeout used by the connections of `default_client`
 
     Args:
         timeout: number of seconds after which the connection attempt should timeout
     """
-    socket.setdefaulttimeout(timeout)
+    default_client.timeout = timeout
 
 
-def download_to_file(url, fname=None, reporthook=None):
-    """Wrapper around urllib.urlretrieve
+def download_to_file(url, fname=None, reporthook=None, resume=False, segments=1,
+                     budget=INTERACTIVE):
+    """Download the contents of `url` to a file using `default_client`
+    (see `HTTPClient.download_to_file`)
     """
-    try:
-        return urlretrieve(url, fname, reporthook)
-    except IOError as err:
-        if not test_connection():
-            raise ConnectionError('No connection')
-        raise ResponseError('Error during download: %s' % err)
+    return default_client.download_to_file(url, fname, reporthook, resume, segments, budget)
+
+
+def cache_lifetime(headers):
+    """Return the number of seconds for which a response with the (lower-cased)
+    `headers` may be cached according to its Cache-Control or Expires headers
+    (None if neither specifies it)
+    """
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name in ('no-cache', 'no-store'):
+            return 0
+        elif name == 'max-age':
+            try:
+                return max(0, int(value.strip('"')))
+            except ValueError:
+                pass
+    expires = parsedate_tz(headers.get('expires', ''))
+    if expires is None:
+        return None
+    date = parsedate_tz(headers.get('date', ''))
+    base = mktime_tz(date) if date is not None else time()
+    return max(0, int(mktime_tz(expires) - base))
 
 
 def default_to_http(url):
@@ -51,14 +707,22 @@ def default_to_http(url):
 
 
 def test_connection():
-    """Return whether the internet connection is up.
+    """Return whether the internet connection is up (see `ConnectivityMonitor`).
     """
-    try:
-        urlopen('http://www.google.com')
-    except (HTTPError, URLError):
-        return False
-    else:
-        return True
+    return connectivity.is_online()
+
+
+def fetch(url, headers=None):
+    """Return a `Response` for the contents of `url` using `default_client`
+    (see `HTTPClient.fetch`)
+    """
+    return default_client.fetch(url, headers)
+
+
+def make_soup(markup):
+    """Return a BeautifulSoup instance for the string `markup`
+    """
+    return BeautifulSoup(markup, 'lxml')
 
 
 def get_soup(url):
@@ -68,18 +732,10 @@ def get_soup(url):
         ConnectionError: If no internet connection detected
         ResponseError: If an error occurs in another process
     """
-    try:
-        response = urlopen(url).read()
-    except ValueError as err:
-        raise ResponseError(str(err))
-    except (HTTPError, URLError) as err:
-        if not test_connection():
-            raise ConnectionError('No connection')
-        raise ResponseError(str(err.reason))
-    return BeautifulSoup(response, 'lxml')
+    return make_soup(fetch(url).body)
 
 
-def _meta_redirect(soup):
+def meta_redirect(soup):
     """If one exists, return the meta redirect url for the `soup` object.
     Else, return None.
     """
@@ -91,10 +747,10 @@ def get_meta_redirect(url):
     """If one exists, return the meta redirect url for the page at `url`.
     Else, return None.
     """
-    return _meta_redirect(get_soup(url))
+    return meta_redirect(get_soup(url))
 
 
-def _rss_link(soup):
+def rss_link(soup):
     """If one exists, return the RSS url for the `soup` object.
     Else, return None.
     """
@@ -106,8 +762,4 @@ def get_rss_link(url):
     """If one exists, return the RSS url for the page at `url`.
     Else, return None.
     """
-    return _rss_link(get_soup(url))
-
-
-if socket.getdefaulttimeout() is None:
-    set_global_timeout()
+    return rss_link(get_soup(url))
@@ -4,7 +4,8 @@ from datetime import datetime
 
 from dateutil import parser as dateutil_parser
 from dateutil.tz import tzutc
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, \
+        Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -22,16 +23,28 @@ class Podcast(BaseModel):
     id = Column(Integer, primary_key=True)
     name = Column(String(128))
     rss_url = Column(String(2047))
+    # The URL provided by the user and the URLs visited when resolving it to `rss_url`
+    source_url = Column(String(2047))
+    redirect_chain = Column(Text, nullable=True)
+    resolved_at = Column(DateTime(timezone=True), nullable=True)
     last_checked = Column(DateTime(timezone=True))
     last_updated = Column(DateTime(timezone=True))
+    # when the feed is next due to be checked (see `schedule.RefreshScheduler`)
+    next_check = Column(DateTime(timezone=True), nullable=True, index=True)
     playback_rate = Column(Integer)
+    # the number of newest unplayed episodes kept downloaded (0 to disable)
+    prefetch_count = Column(Integer, nullable=True)
+    etag = Column(String(255), nullable=True)
+    last_modified = Column(String(64), nullable=True)
     episodes = relationship('Episode', order_by='Episode.date_published', cascade='all, delete, delete-orphan')
 
     def __init__(self, **kwargs):
         if 'last_updated' not in kwargs or kwargs['last_updated'] is None:
             kwargs['last_updated'] = datetime.now(tzutc())
+        kwargs.setdefault('source_url', kwargs.get('rss_url'))
         kwargs['last_checked'] = _EPOCH
         kwargs['playback_rate'] = 100
+        kwargs.setdefault('prefetch_count', 0)
         BaseModel.__init__(self, **kwargs)
 
     def check(self):
@@ -40,17 +53,42 @@ class Podcast(BaseModel):
     def has_update(self):
         return self.last_checked < self.last_updated
 
+    def set_resolution(self, chain):
+        """Record the URLs visited when resolving `source_url` to its feed
+        """
+        self.redirect_chain = '\n'.join(chain)
+        self.resolved_at = datetime.now(tzutc()).replace(tzinfo=None)
+
+    def needs_resolution(self, ttl):
+        """Return whether the resolution of `source_url` is older than the
+        timedelta `ttl`
+        """
+        if self.resolved_at is None:
+            return True
+        return datetime.now(tzutc()).replace(tzinfo=None) - self.resolved_at > ttl
+
 
 class Episode(BaseModel):
     """
     """
     __tablename__ = 'episodes'
+    __table_args__ = (
+        # the episodes of a podcast by date (e.g. `Controller.episodes`)
+        Index('ix_episodes_podcast_id_date_published', 'podcast_id', 'date_published'),
+        # the identity of an episode within its podcast (see `Controller._update_podcast`)
+        Index('ix_episodes_identity', 'podcast_id', 'title', 'url', 'date_published',
+              unique=True),
+    )
     id = Column(Integer, primary_key=True)
     podcast_id = Column(Integer, ForeignKey('podcasts.id'))
     title = Column(String(128))
     url = Column(String(2047))
     date_published = Column(DateTime(timezone=True))
     last_position = Column(Integer, nullable=True)
+    last_played = Column(DateTime(timezone=True), nullable=True)
+    # when the episode's file was evicted to meet the storage quota (see
+    # `Controller._enforce_quota`), None once downloaded again
+    date_evicted = Column(DateTime(timezone=True), nullable=True)
     local_file = relationship('EpisodeFile', uselist=False)
 
     def __init__(self, **kwargs):
@@ -68,10 +106,30 @@ class Episode(BaseModel):
 class EpisodeFile(BaseModel):
     __tablename__ = 'files'
     id = Column(Integer, primary_key=True)
-    episode_id = Column(Integer, ForeignKey('episodes.id'))
+    episode_id = Column(Integer, ForeignKey('episodes.id'), index=True)
     uri = Column(String(1024))
     date_created = Column(DateTime(timezone=True))
+    # the size of the file in bytes (see `Controller._enforce_quota`)
+    size = Column(BigInteger, nullable=True)
 
     def __init__(self, **kwargs):
         kwargs.setdefault('date_created', datetime.now(tzutc()))
         BaseModel.__init__(self, **kwargs)
+
+
+class Download(BaseModel):
+    """A queued episode download (see `downloads.DownloadManager`)
+
+    The row is removed once the download completes; a failed download keeps
+    its row (and error) so that it is retried on the next start.
+    """
+    __tablename__ = 'downloads'
+    id = Column(Integer, primary_key=True)
+    episode_id = Column(Integer, ForeignKey('episodes.id'), unique=True)
+    priority = Column(Integer)
+    date_added = Column(DateTime(timezone=True))
+    error = Column(String(1024), nullable=True)
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('date_added', datetime.now(tzutc()))
+        BaseModel.__init__(self, **kwargs)
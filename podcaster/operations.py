@@ -1,19 +1,51 @@
-from podcaster.model import Podcast, Episode, EpisodeFile, BaseModel
-from podcaster.rss import get_podcast
+from podcaster.model import Podcast, Episode, EpisodeFile, Download, BaseModel
+from podcaster.db import sqlite_engine
+from podcaster.rss import get_podcast, NotModified
 from podcaster.store import SimplerFileStore
-from podcaster.http import download_to_file, ConnectionError, ResponseError
+from podcaster.http import download_to_file, download_length, connectivity, bandwidth, \
+                           ConnectionError, ResponseError, INTERACTIVE, BACKGROUND
+from podcaster.schedule import RefreshScheduler
+from podcaster.downloads import DownloadManager, PRIORITY_PLAY, PRIORITY_PREFETCH, \
+                                PRIORITY_BACKFILL
+from podcaster.stream import PartialFile, LoopbackServer
+from podcaster.positions import PositionTracker
 from podcaster.view import ASCIIView
 
+from collections import namedtuple
 from contextlib import contextmanager
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+import os
+import threading
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from dateutil.tz import tzutc
+from sqlalchemy import bindparam, func, or_
+from sqlalchemy.orm import sessionmaker, joinedload, contains_eager
+
+
+# The prefix of the uris of the episode files in the store
+_URI_PREFIX = 'file://'
+
+
+# The podcast state needed by a refresh worker to fetch a feed
+_RefreshJob = namedtuple('_RefreshJob', ('podcast_id', 'rss_url', 'etag', 'last_modified',
+                                         'source_url', 'resolve'))
 
 
 class SessionError(Exception):
     pass
 
 
+def _episode_identity(title, url, published):
+    """Return the hashable identity of an episode within a podcast
+
+    The timezone is dropped from `published` as it is when stored in the db.
+    """
+    if published is not None:
+        published = published.replace(tzinfo=None)
+    return (title, url, published)
+
+
 def _with_session(func):
     def with_session(self, *args, **kwargs):
         with self.session():
@@ -22,15 +54,85 @@ def _with_session(func):
 
 
 class Controller(object):
-    def __init__(self, db_fname=None):
-        db_path = 'sqlite://'
-        if db_fname is not None:
-            db_path = '/'.join((db_path, db_fname))
-        self._engine = create_engine(db_path, echo=False)
+    def __init__(self, db_fname=None, refresh_workers=8, resolve_ttl=timedelta(days=7),
+                 scheduler=None, download_workers=2, downloads_per_host=2,
+                 download_segments=1, stream_buffer=512 * 1024, interactive_rate=None,
+                 background_rate=None, backfill_window=None, dedupe_files=False,
+                 quota=None, position_interval=30.):
+        """
+        Args:
+            db_fname: The file name of the sqlite database (in-memory if None)
+            refresh_workers: The maximum number of feeds fetched concurrently
+                when updating podcasts
+            resolve_ttl: The timedelta after which a podcast's resolved feed
+                URL is revalidated against the URL provided by the user
+            scheduler: The `RefreshScheduler` deciding when each podcast is
+                next due to be checked (a default one if None)
+            download_workers: The number of episodes downloaded concurrently
+                in the background
+            downloads_per_host: The maximum number of background downloads
+                from a single host at once
+            download_segments: The number of byte ranges of an episode fetched
+                concurrently when the host supports it (see
+                `http.HTTPClient.download_to_file`)
+            stream_buffer: The number of bytes of an episode downloaded before
+                it is played from its partial download (None to always wait
+                for the download to complete)
+            interactive_rate: The limit in bytes per second on the combined
+                rate of downloads of episodes being played (None for no limit)
+            background_rate: The limit in bytes per second on the combined
+                rate of all other downloads (None for no limit)
+            backfill_window: A 2-tuple of `datetime.time` of the form
+                (start, end) outside of which backfill downloads are not
+                started (see `downloads.in_window`)
+            dedupe_files: If True, identical episode files (e.g. an enclosure
+                republished by several feeds) are stored once
+            quota: The number of bytes of downloaded episodes to keep, beyond
+                which episodes are evicted (played episodes first, least
+                recently played first). None for no limit.
+            position_interval: The maximum number of seconds for which
+                playback positions are buffered before being saved (see
+                `positions.PositionTracker`)
+        """
+        self._engine = sqlite_engine(db_fname)
         BaseModel.metadata.create_all(self._engine)
-        self._session = None
+        self._session_factory = sessionmaker(bind=self._engine)
+        # sessions are per-thread so that background work gets its own
+        self._local = threading.local()
         self.view = ASCIIView(self)
-        self._store = SimplerFileStore('.podcasts')
+        self._store = SimplerFileStore('.podcasts', dedupe=dedupe_files)
+        self._quota = quota
+        # the total size of the stored files (loaded from the db when first needed)
+        self._stored_bytes = None
+        self._quota_lock = threading.Lock()
+        # serializes evictions so that concurrent downloads never evict the same file twice
+        self._evict_lock = threading.Lock()
+        self._refresh_workers = refresh_workers
+        self._resolve_ttl = resolve_ttl
+        self._scheduler = scheduler or RefreshScheduler()
+        self._refresh_lock = threading.Lock()
+        self._pending_refresh = set()
+        self._downloads = DownloadManager(self._download_queued, download_workers,
+                                          downloads_per_host, backfill_window)
+        bandwidth.set_rate(INTERACTIVE, interactive_rate)
+        bandwidth.set_rate(BACKGROUND, background_rate)
+        self._download_segments = download_segments
+        self._stream_buffer = stream_buffer
+        # episodes being played from their partial downloads
+        self._streaming = set()
+        # episodes being played (and so never evicted)
+        self._playing = set()
+        self._positions = PositionTracker(self._save_episode_states, position_interval)
+
+    @property
+    def _session(self):
+        """The session in progress on the current thread (None if there is none)
+        """
+        return getattr(self._local, 'session', None)
+
+    @_session.setter
+    def _session(self, session):
+        self._local.session = session
 
     @contextmanager
     def session(self):
@@ -38,23 +140,70 @@ class Controller(object):
 
         On enter: Create a new db session (provided one is not already in
             progress)
-        On exit: Commit the session (provided one was created)
+        On exit: Commit the session (provided one was created) or, if an
+            exception was raised, roll it back
         """
         new_session = self._session is None
-        if new_session:
-            self._session = sessionmaker(bind=self._engine)()
-        yield self._session
-        self._session.flush()
-        if new_session:
-            self._session.commit()
+        if not new_session:
+            yield self._session
+            self._session.flush()
+            return
+        session = self._session = self._session_factory()
+        try:
+            yield session
+            session.flush()
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
             self._session = None
 
+    def checkpoint(self):
+        """Commit the session in progress (if any) so that no database locks
+        are held while waiting on the user or the player
+        """
+        if self._session is not None:
+            self._session.commit()
+
     @staticmethod
-    def _paginate(query, limit, offset=0):
-        total = query.count()
-        last_ind = offset + limit
-        range_ = (offset, None if last_ind >= total else last_ind)
-        return (query.limit(limit).offset(offset), range_)
+    def _seek(query, key, limit, start=None, end=None):
+        """Return a page of at most `limit` items of `query` in descending
+        order of the 2 columns `key` (which should be unique together)
+
+        The page is located by the values of `key` at its boundaries (a
+        cursor) rather than by offset so that it is found by an index seek
+        however deep it lies: it begins with the item at `start` or, if `end`
+        is given instead, ends with the item just before `end`. If neither is
+        given it is the first page.
+
+        Returns:
+            A 2-tuple of the form (items, cursors) where `cursors` is a 2-tuple
+            of the form (prev_end, next_start) of the cursors locating the
+            pages either side (None if there is no page on that side)
+        """
+        first, second = key
+        cursor = lambda item: (getattr(item, first.key), getattr(item, second.key))
+        if end is not None:
+            # walk back from `end` and then flip the page around
+            items = query.filter(first >= end[0], or_(first > end[0], second > end[1]))\
+                         .order_by(first, second).limit(limit + 1).all()
+            if len(items) <= limit:
+                # too near the start to fill a page of its own
+                return Controller._seek(query, key, limit)
+            items = items[limit - 1::-1]
+            return (items, (cursor(items[0]), end))
+        page_query = query
+        if start is not None:
+            page_query = query.filter(first <= start[0],
+                                      or_(first < start[0], second <= start[1]))
+        items = page_query.order_by(first.desc(), second.desc()).limit(limit + 1).all()
+        if start is not None and not items:
+            # everything from `start` on has gone
+            return Controller._seek(query, key, limit)
+        prev_end = cursor(items[0]) if start is not None else None
+        next_start = cursor(items[limit]) if len(items) > limit else None
+        return (items[:limit], (prev_end, next_start))
 
     @_with_session
     def all_podcasts(self):
@@ -62,73 +211,303 @@ class Controller(object):
         return self.view.all_podcasts(podcasts)
 
     @_with_session
-    def episodes(self, podcast_id, base=0):
+    def episodes(self, podcast_id, start=None, end=None):
+        """List a page of the episodes of a podcast, newest first
+
+        Args:
+            podcast_id: The id of the podcast
+            start: The cursor of the first episode of the page
+            end: The cursor of the episode just after the page
+            (see `_seek`; the first page if neither is given)
+        """
         podcast = self._session.query(Podcast).get(podcast_id)
         podcast.check()
-        episode_query = self._session.query(Episode)\
-                            .filter_by(podcast_id=podcast_id)\
-                            .order_by(Episode.date_published.desc())
-        episodes, page_range = Controller._paginate(episode_query, 10, base)
-        return self.view.episodes(podcast, episodes, page_range)
+        # the view marks the downloaded episodes
+        episode_query = self._session.query(Episode).filter_by(podcast_id=podcast_id)\
+                            .options(joinedload(Episode.local_file))
+        episodes, cursors = Controller._seek(episode_query, (Episode.date_published, Episode.id),
+                                             10, start, end)
+        return self.view.episodes(podcast, episodes, cursors)
 
     @_with_session
     def downloaded_episodes(self):
-        episode_query = self._session.query(Episode, Podcast)\
-                                    .filter(Episode.podcast_id == Podcast.id)\
-                                    .join(EpisodeFile)\
-                                    .order_by(EpisodeFile.date_created.desc())
-        episodes = [episode for episode, _ in episode_query.all()]
-        podcasts = [podcast for _, podcast in episode_query.all()]
+        rows = self._session.query(Episode, Podcast)\
+                            .filter(Episode.podcast_id == Podcast.id)\
+                            .join(Episode.local_file)\
+                            .options(contains_eager(Episode.local_file))\
+                            .order_by(EpisodeFile.date_created.desc())\
+                            .all()
+        episodes = [episode for episode, _ in rows]
+        podcasts = [podcast for _, podcast in rows]
         return self.view.downloaded_episodes(episodes, podcasts)
 
     @_with_session
-    def update_podcasts(self, cb_return_menu):
+    def update_podcasts(self, cb_return_menu, force=False):
+        """Update the podcasts that are due to be checked
+
+        Args:
+            cb_return_menu: The menu callback to be returned upon completion
+            force: If True, update all podcasts regardless of their schedule
+        """
         self.view.update(start=True)
-        podcasts = self._session.query(Podcast).all()
-        for podcast in podcasts:
-            try:
-                self._update_podcast(podcast)
-            except (ConnectionError, ResponseError) as err:
-                self.view.update(error=(podcast, 'Failed to connect to update \
-                    server (%s)' % str(err)))
+        self._update_all(force=force)
         self.view.update(end=True)
         return cb_return_menu
 
+    def update_podcasts_async(self):
+        """Update the podcasts that are due to be checked on a background thread
+
+        Each podcast's update is committed as soon as it is applied and
+        reported to the view so that it is visible to menus immediately.
+
+        Returns:
+            The (daemon) thread performing the update
+        """
+        with self.session():
+            self._pending_refresh.update(id_ for id_, in self._due_podcasts(Podcast.id))
+        thread = threading.Thread(target=self._update_all_async)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @_with_session
+    def _update_all_async(self):
+        try:
+            self._update_all(background=True)
+        finally:
+            self._pending_refresh.clear()
+
+    def is_refresh_pending(self, podcast_id):
+        """Return whether a background update of the podcast has yet to complete
+        """
+        return podcast_id in self._pending_refresh
+
+    def _due_podcasts(self, *entities):
+        """Return a query for `entities` of the podcasts due to be checked
+        """
+        now = datetime.now(tzutc()).replace(tzinfo=None)
+        return self._session.query(*entities)\
+                    .filter(or_(Podcast.next_check == None, Podcast.next_check <= now))
+
+    def _update_all(self, background=False, force=False):
+        """Fetch and apply the feeds of the podcasts due to be checked
+
+        Args:
+            background: If True, commit and report each podcast as it is updated
+            force: If True, update all podcasts regardless of their schedule
+        """
+        with self._refresh_lock:
+            query = self._session.query(Podcast) if force else self._due_podcasts(Podcast)
+            podcasts = dict((podcast.id, podcast) for podcast in query)
+            jobs = [self._refresh_job(podcast) for podcast in podcasts.itervalues()]
+            # don't attempt any fetches while the connection is known to be down
+            if jobs and connectivity.offline and not connectivity.is_online():
+                self.view.update(offline=len(jobs))
+                return
+            remaining = len(jobs)
+            for podcast_id, feed, error in self._fetch_podcasts(jobs):
+                # abandon the remaining fetches once the connection is known to be down
+                if isinstance(error, ConnectionError) and connectivity.offline:
+                    self.view.update(offline=remaining)
+                    break
+                self._handle_update(podcasts[podcast_id], feed, error)
+                remaining -= 1
+                if background:
+                    self._session.commit()
+                    self._pending_refresh.discard(podcast_id)
+                    self.view.update(podcast=podcasts[podcast_id])
+
     @_with_session
     def update_podcast(self, podcast_id, cb_return_menu):
         self.view.update(start=True)
         podcast = self._session.query(Podcast).get(podcast_id)
-        try:
-            self._update_podcast(podcast)
-        except (ConnectionError, ResponseError) as err:
-            self.view.update(error=(podcast, 'Failed to connect to update \
-                server (%s)' % str(err)))
+        with self._refresh_lock:
+            _, feed, error = Controller._fetch_podcast(self._refresh_job(podcast))
+            self._handle_update(podcast, feed, error)
         self.view.update(end=True)
         return cb_return_menu
 
-    def _update_podcast(self, podcast):
-        podcast_tuple, episode_iter = get_podcast(podcast.rss_url)
-        _, _, last_updated, _, _, _ = podcast_tuple
+    def _refresh_job(self, podcast):
+        """Return the `_RefreshJob` for `podcast`
+        """
+        return _RefreshJob(podcast.id, podcast.rss_url, podcast.etag, podcast.last_modified,
+                           podcast.source_url or podcast.rss_url,
+                           podcast.needs_resolution(self._resolve_ttl))
+
+    @staticmethod
+    def _fetch_podcast(job):
+        """Fetch and parse the feed for a single podcast
+
+        The cached feed URL is fetched directly unless it is due for
+        revalidation or stops yielding a feed, in which case the URL provided
+        by the user is resolved again (including any HTML discovery).
+
+        NOTE: This is run on refresh worker threads so it must not touch the
+            database session.
+
+        Args:
+            job: A `_RefreshJob`
+
+        Returns:
+            A 3-tuple of the form (podcast_id, feed, error) where `feed` is a
+            2-tuple of the form (podcast_data, episode_tuples) on success and
+            `error` is the exception raised on failure (`NotModified` if the
+            feed is unchanged)
+        """
+        if connectivity.offline:
+            # skip the jobs still queued once the connection is known to be down
+            return (job.podcast_id, None, ConnectionError('No connection'))
+        try:
+            podcast_data, episode_iter = None, None
+            if not job.resolve:
+                try:
+                    podcast_data, episode_iter = get_podcast(job.rss_url, job.etag,
+                                                             job.last_modified, discover=False)
+                except ResponseError:
+                    # resolving again would only fetch the same URL
+                    if job.source_url == job.rss_url:
+                        raise
+            if podcast_data is None:
+                # validators only apply when resolution starts at the feed itself
+                validators = (job.etag, job.last_modified) \
+                                if job.source_url == job.rss_url else (None, None)
+                podcast_data, episode_iter = get_podcast(job.source_url, *validators)
+            return (job.podcast_id, (podcast_data, list(episode_iter)), None)
+        except (NotModified, ConnectionError, ResponseError) as err:
+            return (job.podcast_id, None, err)
+
+    def _fetch_podcasts(self, jobs):
+        """Return an iterator over the fetched feeds for `jobs` in the order in
+        which they complete.
+
+        Feeds are fetched and parsed by a bounded pool of worker threads while
+        the results are consumed on the calling thread, so the database
+        session is only ever used by a single writer.
+
+        Args:
+            jobs: A list of `_RefreshJob` tuples
+        """
+        if not jobs:
+            return
+        pool = ThreadPool(max(1, min(self._refresh_workers, len(jobs))))
+        try:
+            for result in pool.imap_unordered(Controller._fetch_podcast, jobs):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _handle_update(self, podcast, feed, error):
+        """Apply a fetched feed to `podcast` or report the error encountered
+        while fetching it, then schedule the podcast's next check.
+        """
+        if isinstance(error, NotModified):
+            self._schedule(podcast, error.cache_lifetime)
+        elif error is not None:
+            self.view.update(error=(podcast, 'Failed to connect to update \
+                server (%s)' % str(error)))
+            podcast.next_check = self._scheduler.retry_check()
+        elif feed[0] is None:
+            self.view.update(error=(podcast, 'Failed to extract a Podcast RSS feed'))
+            podcast.next_check = self._scheduler.retry_check()
+        else:
+            self._update_podcast(podcast, *feed)
+            self._schedule(podcast, feed[0].cache_lifetime)
+            self._prefetch(podcast)
+
+    def _schedule(self, podcast, cache_lifetime):
+        """Set the time at which `podcast` is next due to be checked from its
+        publishing history and the feed's `cache_lifetime`
+        """
+        dates = [date for date, in self._session.query(Episode.date_published)
+                                            .filter_by(podcast_id=podcast.id)
+                                            .order_by(Episode.date_published.desc())
+                                            .limit(self._scheduler.history)]
+        podcast.next_check = self._scheduler.next_check(dates, cache_lifetime)
+
+    def _prefetch(self, podcast):
+        """Queue downloads of the newest `podcast.prefetch_count` unplayed
+        episodes of `podcast` that are not yet downloaded
+
+        Episodes evicted to meet the quota are not downloaded again, which
+        would only evict another episode (or the same one) in turn.
+
+        Returns:
+            A list of the `downloads.DownloadTicket` of each queued download
+        """
+        if not podcast.prefetch_count:
+            return []
+        newest = self._session.query(Episode.id, EpisodeFile.id)\
+                            .outerjoin(EpisodeFile)\
+                            .filter(Episode.podcast_id == podcast.id,
+                                    Episode.last_position == None,
+                                    Episode.last_played == None,
+                                    Episode.date_evicted == None)\
+                            .order_by(Episode.date_published.desc())\
+                            .limit(podcast.prefetch_count)
+        return [self.queue_download(episode_id, PRIORITY_PREFETCH)
+                for episode_id in [id_ for id_, file_id in newest if file_id is None]]
+
+    @_with_session
+    def set_prefetch_count(self, podcast_id, count):
+        """Set the number of newest unplayed episodes of a podcast kept
+        downloaded, queueing any that are missing
+
+        Returns:
+            A list of the `downloads.DownloadTicket` of each queued download
+        """
+        podcast = self._session.query(Podcast).get(podcast_id)
+        podcast.prefetch_count = count
+        return self._prefetch(podcast)
+
+    def _update_podcast(self, podcast, podcast_data, episode_tuples):
+        """Reconcile the episodes of `podcast` with those of a fetched feed
+
+        The existing episode identities are loaded in a single query and
+        diffed against `episode_tuples` in memory so that the number of
+        statements issued is independent of the size of the feed.
+        """
+        podcast.etag = podcast_data.etag
+        podcast.last_modified = podcast_data.last_modified
+        if podcast_data.chain[0] == (podcast.source_url or podcast.rss_url):
+            podcast.set_resolution(podcast_data.chain)
+        podcast.rss_url = podcast_data.rss_url
+        last_updated = podcast_data.last_updated
         if last_updated is None or \
                 last_updated.replace(tzinfo=None) <= podcast.last_updated:
             return
         podcast.last_updated = last_updated.replace(tzinfo=None)
-        updated_ids = set([])
-        episode_query = self._session.query(Episode).filter_by(podcast_id=podcast.id)
-        for episode_tuple in episode_iter:
+        existing = dict((_episode_identity(title, url, published), id_)
+                        for id_, title, url, published in
+                        self._session.query(Episode.id, Episode.title, Episode.url,
+                                            Episode.date_published)
+                                     .filter_by(podcast_id=podcast.id))
+        new_rows = []
+        updated = set()
+        for episode_tuple in episode_tuples:
             url, title, _, published = episode_tuple
-            episode = episode_query.filter_by(title=title, url=url,
-                                                    date_published=published).scalar()
-            if episode is None:
-                episode = Episode(podcast_id=podcast.id, title=title, url=url,
-                                        date_published=published)
-                podcast.episodes.append(episode)
-                # ensure episode is added to the db so it is assigned an ID
-                self._session.flush()
-            updated_ids.add(episode.id)
-        absent_ids = episode_query.filter(~Episode.id.in_(updated_ids))
-        for episode in absent_ids:
-            self._session.delete(episode)
+            identity = _episode_identity(title, url, published)
+            if identity not in existing and identity not in updated:
+                new_rows.append({'podcast_id': podcast.id, 'title': title, 'url': url,
+                                 'date_published': published})
+            updated.add(identity)
+        absent_ids = [id_ for identity, id_ in existing.iteritems() if identity not in updated]
+        if new_rows:
+            self._session.execute(Episode.__table__.insert(), new_rows)
+        if absent_ids:
+            # each statement is executed once for all of the absent episodes
+            absent = [{'absent_id': id_} for id_ in absent_ids]
+            # detach any downloaded files as the ORM would for a per-object delete
+            self._session.execute(EpisodeFile.__table__.update()
+                                        .where(EpisodeFile.episode_id == bindparam('absent_id'))
+                                        .values(episode_id=None), absent)
+            self._session.execute(Download.__table__.delete()
+                                        .where(Download.episode_id == bindparam('absent_id')),
+                                  absent)
+            self._session.execute(Episode.__table__.delete()
+                                        .where(Episode.id == bindparam('absent_id')), absent)
+        if new_rows or absent_ids:
+            self._session.expire(podcast, ['episodes'])
 
     def get_podcast_name(self, podcast_url):
         """Return the name of the podcast referred to by `podcast_url`
@@ -139,13 +518,12 @@ class Controller(object):
             On RSS failure: None
         """
         try:
-            podcast_tuple, _ = get_podcast(podcast_url)
+            podcast_data, _ = get_podcast(podcast_url)
         except (ConnectionError, ResponseError) as err:
             return (None, str(err))
-        if podcast_tuple is None:
+        if podcast_data is None:
             return None
-        title, _, _, _, _, _ = podcast_tuple
-        return title
+        return podcast_data.title
 
     def add_podcast(self):
         """Dummy operation to transfer control to the view `add_podcast`
@@ -164,15 +542,25 @@ class Controller(object):
             On failure: An error string
         """
         try:
-            podcast_tuple, episode_iter = get_podcast(podcast_url)
+            podcast_data, episode_iter = get_podcast(podcast_url)
         except (ConnectionError, ResponseError) as err:
             return str(err)
-        title, rss_url, last_updated, _, _, _ = podcast_tuple
-        podcast = Podcast(name=title, rss_url=rss_url, last_updated=last_updated)
+        podcast = Podcast(name=podcast_data.title, rss_url=podcast_data.rss_url,
+                            source_url=podcast_url,
+                            last_updated=podcast_data.last_updated,
+                            etag=podcast_data.etag,
+                            last_modified=podcast_data.last_modified)
+        podcast.set_resolution(podcast_data.chain)
         self._session.add(podcast)
         self._session.flush()
+        seen = set()
         for episode_tuple in reversed(list(episode_iter)):
             url, title, _, published = episode_tuple
+            # feeds occasionally repeat an item
+            identity = _episode_identity(title, url, published)
+            if identity in seen:
+                continue
+            seen.add(identity)
             episode = Episode(podcast_id=podcast.id, title=title, url=url, date_published=published)
             podcast.episodes.append(episode)
 
@@ -190,12 +578,85 @@ class Controller(object):
         """
         episode = self._session.query(Episode).get(episode_id)
         podcast = self._session.query(Podcast).get(episode.podcast_id)
-        if not episode.is_downloaded() and not self.view.download(episode):
-            return cb_return_menu
-        return self.view.play(podcast, episode, cb_return_menu)
+        episode.last_played = datetime.now(tzutc()).replace(tzinfo=None)
+        self.checkpoint()
+        self._playing.add(episode_id)
+        try:
+            if episode.is_downloaded():
+                cb_return_menu = self.view.play(podcast, episode, cb_return_menu)
+            elif self._can_stream(episode_id):
+                cb_return_menu = self._play_streaming(podcast, episode, cb_return_menu)
+            elif self.view.download(episode):
+                # the file was recorded by a download worker's session
+                self._session.refresh(episode)
+                cb_return_menu = self.view.play(podcast, episode, cb_return_menu)
+            else:
+                return cb_return_menu
+        finally:
+            self._playing.discard(episode_id)
+        # the episode just played may have made room for another
+        self._prefetch(podcast)
+        return cb_return_menu
+
+    def _can_stream(self, episode_id):
+        """Return whether an episode may be played from its partial download,
+        marking it as streaming if so (see `_play_streaming`)
+
+        Only single-stream downloads are written in order, so an episode
+        already being downloaded in segments must be waited for.
+        """
+        if self._stream_buffer is None:
+            return False
+        # marked before checking the ticket so that a download started
+        # meanwhile (e.g. a prefetch) is never segmented
+        self._streaming.add(episode_id)
+        ticket = self._downloads.ticket(episode_id)
+        if ticket is None or not ticket.is_started() or self._download_segments == 1:
+            return True
+        self._streaming.discard(episode_id)
+        return False
+
+    def _play_streaming(self, podcast, episode, cb_return_menu):
+        """Play an episode from its partial download once `stream_buffer`
+        bytes have been downloaded, while the rest downloads in the background.
+
+        The player is served the partial file over a loopback HTTP server
+        (see `stream.LoopbackServer`) as reads past the downloaded data must
+        block rather than end playback. The episode must have been marked as
+        streaming by `_can_stream`.
+        """
+        fname = self._store.partial_path(self._episode_key(episode.id))
+        started = threading.Event()
+        def buffered():
+            """Return whether enough of the episode has been downloaded"""
+            try:
+                return started.is_set() and os.path.getsize(fname) >= self._stream_buffer
+            except OSError:
+                # moved into the store on completion
+                return False
+        try:
+            ticket = self.queue_download(episode.id, PRIORITY_PLAY,
+                                         lambda ratio: started.set())
+            if not self.view.buffer(episode, ticket, buffered):
+                return cb_return_menu
+            try:
+                partial_file = PartialFile(fname, ticket.is_done, download_length(fname)) \
+                                if not ticket.is_done() else None
+            except IOError:
+                # the download completed (and was moved into the store) meanwhile
+                partial_file = None
+            if partial_file is None:
+                if ticket.wait():
+                    return cb_return_menu
+                self._session.refresh(episode)
+                return self.view.play(podcast, episode, cb_return_menu)
+            with LoopbackServer(partial_file) as server:
+                return self.view.play(podcast, episode, cb_return_menu, uri=server.url)
+        finally:
+            self._streaming.discard(episode.id)
 
     @_with_session
-    def download_episode(self, episode_id, cb_progress=None):
+    def download_episode(self, episode_id, cb_progress=None, background=False):
         """Attempt to download an episode
 
         Args:
@@ -205,12 +666,17 @@ class Controller(object):
                 download.
                 NOTE: If this information is not available, the callback will
                 be called with `None`
+            background: If True, the download is limited to the background
+                rather than the interactive bandwidth budget
 
         Return:
             On Success: None
             On Failure: An error string
         """
         episode = self._session.query(Episode).get(episode_id)
+        if episode is None:
+            # e.g. removed from its feed by a refresh while queued
+            return 'Episode no longer exists'
         key = self._episode_key(episode_id)
         # Define callback closure to convert download callback format to progress format
         if cb_progress is not None:
@@ -219,23 +685,153 @@ class Controller(object):
                 Else, call it with `None`
                 """
                 if total_size != -1:
-                    cb_progress((1. * chunk_size * chunk_num) / total_size)
+                    cb_progress(min(1., (1. * chunk_size * chunk_num) / total_size))
                 else:
                     cb_progress(None)
         else:
             cb_report = None
-        # Attempt download
+        # Attempt download, resuming any previous attempt staged in the store
+        local_fname = self._store.partial_path(key)
+        # a file being played as it downloads must be written in order
+        segments = 1 if episode_id in self._streaming else self._download_segments
         try:
-            local_fname, _ = download_to_file(episode.url, reporthook=cb_report)
+            download_to_file(episode.url, local_fname, reporthook=cb_report, resume=True,
+                             segments=segments,
+                             budget=BACKGROUND if background else INTERACTIVE)
         except (ConnectionError, ResponseError) as err:
             return str(err)
         else:
-            with open(local_fname, 'rb') as file_:
-                self._store.put(key, file_)
-            uri = 'file://' + self._store.get_path(key)
-            episode.local_file = EpisodeFile(episode_id=episode_id, uri=uri)
+            size = os.path.getsize(local_fname)
+            self._store.ingest(key, local_fname)
+            uri = _URI_PREFIX + self._store.get_path(key)
+            episode.local_file = EpisodeFile(episode_id=episode_id, uri=uri, size=size)
+            episode.date_evicted = None
+            self._account(size)
+            self._enforce_quota(keep=[episode_id])
             return None
 
+    def _account(self, delta):
+        """Adjust the total size of the stored files by `delta` bytes
+        """
+        with self._quota_lock:
+            if self._stored_bytes is not None:
+                self._stored_bytes += delta
+
+    def _enforce_quota(self, keep=()):
+        """Evict downloaded episodes until the stored files fit within the quota
+
+        Files detached from their episodes are evicted first, then those of
+        played episodes (least recently played first) and finally those of
+        unplayed episodes (oldest download first).
+
+        The session in progress is committed once any files are evicted so
+        that the next eviction (e.g. by another download worker) sees their
+        removal.
+
+        Args:
+            keep: The ids of episodes whose files must not be evicted (in
+                addition to those being played)
+        """
+        if self._quota is None:
+            return
+        with self._evict_lock:
+            with self._quota_lock:
+                if self._stored_bytes is None:
+                    self._stored_bytes = self._session.query(
+                            func.coalesce(func.sum(EpisodeFile.size), 0)).scalar()
+                excess = self._stored_bytes - self._quota
+            if excess <= 0:
+                return
+            keep = set(keep) | self._playing
+            candidates = self._session.query(EpisodeFile, Episode)\
+                                .outerjoin(Episode, EpisodeFile.episode_id == Episode.id)\
+                                .order_by(EpisodeFile.episode_id != None,
+                                          Episode.last_played == None,
+                                          Episode.last_played,
+                                          EpisodeFile.date_created)
+            if keep:
+                candidates = candidates.filter(or_(EpisodeFile.episode_id == None,
+                                                   ~EpisodeFile.episode_id.in_(keep)))
+            now = datetime.now(tzutc()).replace(tzinfo=None)
+            for local_file, episode in candidates.all():
+                if excess <= 0:
+                    break
+                excess -= local_file.size or 0
+                if episode is not None:
+                    # not prefetched again (see `_prefetch`)
+                    episode.date_evicted = now
+                self._remove_file(local_file)
+            self._session.commit()
+
+    def _remove_file(self, local_file):
+        """Remove a downloaded file from the store along with its `EpisodeFile`
+        """
+        if local_file.uri.startswith(_URI_PREFIX):
+            self._store.remove_path(local_file.uri[len(_URI_PREFIX):])
+        self._session.delete(local_file)
+        self._account(-(local_file.size or 0))
+
+    @_with_session
+    def queue_download(self, episode_id, priority=PRIORITY_BACKFILL, cb_progress=None):
+        """Queue an episode to be downloaded in the background
+
+        The queue is recorded in the database so that unfinished downloads
+        are resumed by `resume_downloads`.
+
+        Args:
+            episode_id: The id of the episode to be downloaded
+            priority: One of the `downloads.PRIORITY_*` constants
+            cb_progress: An optional callback function following the contract
+                of `download_episode` (called from a download thread)
+
+        Returns:
+            The `downloads.DownloadTicket` of the download
+        """
+        episode = self._session.query(Episode).get(episode_id)
+        download = self._session.query(Download).filter_by(episode_id=episode_id).first()
+        if download is None:
+            self._session.add(Download(episode_id=episode_id, priority=priority))
+        else:
+            download.priority = min(download.priority, priority)
+            download.error = None
+        # the download thread must see the queued row
+        self.checkpoint()
+        return self._downloads.enqueue(episode_id, episode.url, priority, cb_progress)
+
+    @_with_session
+    def resume_downloads(self):
+        """Queue the downloads left unfinished by a previous run
+
+        Returns:
+            A list of the `downloads.DownloadTicket` of each download
+        """
+        queued = self._session.query(Download.episode_id, Download.priority, Episode.url)\
+                              .join(Episode, Download.episode_id == Episode.id)\
+                              .order_by(Download.priority, Download.date_added)
+        return [self._downloads.enqueue(episode_id, url, priority)
+                for episode_id, priority, url in queued.all()]
+
+    def download_ticket(self, episode_id):
+        """Return the ticket of the unfinished download of an episode (None if
+        there is none)
+        """
+        return self._downloads.ticket(episode_id)
+
+    @_with_session
+    def _download_queued(self, episode_id, cb_progress, priority):
+        """Download a queued episode and record the outcome in the queue
+
+        NOTE: This is run on download threads, each with a session of its own.
+        """
+        error = self.download_episode(episode_id, cb_progress,
+                                      background=priority != PRIORITY_PLAY)
+        download = self._session.query(Download).filter_by(episode_id=episode_id).first()
+        if error is None and download is not None:
+            self._session.delete(download)
+        elif download is not None:
+            download.error = error
+        return error
+
     @_with_session
     def delete_episode(self, episode_id, cb_return_menu):
         """Delete an episode
@@ -247,17 +843,41 @@ class Controller(object):
         """
         episode = self._session.query(Episode).get(episode_id)
         if episode.local_file is not None:
-            key = self._episode_key(episode_id)
-            self._store.remove(key)
-            self._session.delete(episode.local_file)
+            self._remove_file(episode.local_file)
         return cb_return_menu
 
     def update_episode_state(self, episode_id, position, playback_rate):
-        episode = self._session.query(Episode).get(episode_id)
-        podcast = self._session.query(Podcast).get(episode.podcast_id)
-        episode.last_position = position
-        podcast.playback_rate = playback_rate
-        self._session.flush()
+        """Record the playback state of an episode
+
+        The state is buffered and saved in the background, so call
+        `save_episode_state` to save it at once (e.g. when playback stops).
+        """
+        self._positions.update(episode_id, position, playback_rate)
+        # hold no write lock during playback
+        self.checkpoint()
+
+    def save_episode_state(self):
+        """Save the buffered playback states
+        """
+        self._positions.flush()
+        self.checkpoint()
+
+    def _save_episode_states(self, states):
+        """Save playback states, a dict mapping episode ids to 2-tuples of
+        the form (position, playback_rate)
+
+        The states are saved within the session in progress (if any), which
+        is left for its owner to commit.
+        """
+        with self.session() as session:
+            episodes = session.query(Episode).filter(Episode.id.in_(states.keys())).all()
+            podcasts = dict((podcast.id, podcast) for podcast in
+                            session.query(Podcast).filter(Podcast.id.in_(
+                                set(episode.podcast_id for episode in episodes))))
+            for episode in episodes:
+                position, playback_rate = states[episode.id]
+                episode.last_position = position
+                podcasts[episode.podcast_id].playback_rate = playback_rate
 
     def _episode_key(self, episode_id):
         """Return a (reasonably) unique string identifier for an episode
@@ -0,0 +1,66 @@
+"""Write-behind buffering of playback positions
+"""
+import threading
+import time
+
+
+class PositionTracker(object):
+    """Keep the latest playback state of each episode in memory and persist
+    it in batches
+
+    Updates are coalesced so that only the latest state of each episode is
+    persisted (and not at all if it has not changed since it last was). The
+    buffered states are persisted once `interval` seconds have passed since
+    they last were and whenever `flush` is called (e.g. when playback is
+    paused or stopped, or at exit).
+    """
+    def __init__(self, persist, interval=30., clock=time.time):
+        """
+        Args:
+            persist: The function persisting the buffered states, called with
+                a dict mapping episode ids to 2-tuples of the form
+                (position, playback_rate)
+            interval: The maximum number of seconds an update is buffered
+                while updates continue to arrive
+            clock: A function returning the current time in seconds
+        """
+        self._persist = persist
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._persisted = {}
+        self._last_flush = clock()
+
+    def update(self, episode_id, position, playback_rate):
+        """Record the playback state of an episode, persisting the buffered
+        states if they are due
+        """
+        state = (position, playback_rate)
+        with self._lock:
+            if self._persisted.get(episode_id) == state:
+                self._pending.pop(episode_id, None)
+            else:
+                self._pending[episode_id] = state
+            due = self._clock() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Persist the buffered states (if any)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = self._clock()
+        if not pending:
+            return
+        try:
+            self._persist(pending)
+        except Exception:
+            # keep the states (unless superseded) for the next attempt
+            with self._lock:
+                for episode_id, state in pending.iteritems():
+                    self._pending.setdefault(episode_id, state)
+            raise
+        with self._lock:
+            self._persisted.update(pending)
@@ -1,26 +1,98 @@
 """Interface with RSS pages
 """
-from podcaster.http import get_meta_redirect, get_rss_link
+from podcaster.http import fetch, make_soup, meta_redirect, rss_link, cache_lifetime
+
+from collections import namedtuple
+from urlparse import urljoin
 
 import feedparser
 from dateutil import parser
 
 
-def _parse_feed(url):
+PodcastData = namedtuple('PodcastData', ('title', 'rss_url', 'last_updated',
+                                         'author', 'link', 'summary',
+                                         'etag', 'last_modified', 'chain',
+                                         'cache_lifetime'))
+
+
+class NotModified(Exception):
+    """Indicate the feed has not changed since the validators provided were
+    issued (i.e. an HTTP 304 response)
+
+    cache_lifetime - the number of seconds the server allows the feed to be
+        cached for (None if unspecified)
+    """
+    def __init__(self, cache_lifetime=None):
+        super(NotModified, self).__init__()
+        self.cache_lifetime = cache_lifetime
+
+
+def _conditional_headers(etag, modified):
+    """Return the request headers for a conditional GET with the validators
+    `etag` and `modified`
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    return headers
+
+
+def _parse_feed(url, etag=None, modified=None, responses=None, discover=True):
     """Return feed structured via feedparser on success.
     None on failure
+
+    Each URL is fetched at most once per resolution: the body retrieved is
+    handed both to feedparser and, if it is not a feed, to the HTML search for
+    an RSS link or meta redirect.
+
+    Args:
+        url: The URL to be resolved to a feed
+        etag, modified: Optional validators for a conditional GET of `url`
+        responses: The `http.Response` objects fetched so far in this
+            resolution, keyed by requested URL
+        discover: Whether to search HTML pages for an RSS link or meta redirect
+
+    The returned feed has a 'chain' entry listing the URLs requested from `url`
+    to the feed itself, including those of HTTP redirects.
+
+    Raises:
+        NotModified: If the server reports the feed unchanged since `etag` or
+            `modified`
     """
     if url is None:
         return
+    if responses is None:
+        responses = {}
+    elif url in responses:
+        # already visited in this resolution (i.e. a redirect cycle)
+        return
+    response = fetch(url, _conditional_headers(etag, modified))
+    responses[url] = response
+    if response.status == 304:
+        raise NotModified(cache_lifetime(response.headers))
     # first try to parse directly
-    parsed_feed = feedparser.parse(url)
+    headers = dict(response.headers, **{'content-location': response.url})
+    parsed_feed = feedparser.parse(response.body, response_headers=headers)
+    parsed_feed['href'] = response.url
+    # the URLs requested to retrieve `url` (redirects included)
+    hops = list(response.redirects) + [response.url]
+    parsed_feed['chain'] = hops
+    parsed_feed['cache_lifetime'] = cache_lifetime(response.headers)
 
     # fall back to searching for an rss link
     if parsed_feed.bozo:
-        fallbacks = (get_rss_link, get_meta_redirect)
-        for fallback in fallbacks:
-            feed = _parse_feed(fallback(url))
+        if not discover:
+            return
+        soup = make_soup(response.body)
+        for fallback in (rss_link, meta_redirect):
+            link = fallback(soup)
+            if link is None:
+                continue
+            feed = _parse_feed(urljoin(response.url, link), responses=responses)
             if feed is not None:
+                feed['chain'][:0] = hops
                 return feed
         return
     return parsed_feed if parsed_feed.feed else None
@@ -34,9 +106,10 @@ def _podcast_data(feed):
     last_updated = parser.parse(feed.updated) if 'updated' in feed else \
                     parser.parse(feed.feed.updated) if 'updated' in feed.feed else \
                     None
-    return (feed.feed.title, feed.href, last_updated,
-                feed.feed.get('author', ''), feed.feed.get('link', ''),
-                feed.feed.get('summary', ''))
+    return PodcastData(feed.feed.title, feed.href, last_updated,
+                        feed.feed.get('author', ''), feed.feed.get('link', ''),
+                        feed.feed.get('summary', ''), feed.get('etag'),
+                        feed.get('modified'), tuple(feed.chain), feed.cache_lifetime)
 
 
 def _episode_iter(feed):
@@ -60,10 +133,18 @@ def _episode_iter(feed):
     raise StopIteration()
 
 
-def get_podcast(url):
-    """Return a `Podcast` instance built from the feed retrieved from `url`
+def get_podcast(url, etag=None, modified=None, discover=True):
+    """Return a 2-tuple of the form (podcast_data, episode_iter) built from the
+    feed retrieved from `url`
 
     url - the url of the feed to be processed
+    etag - the ETag validator returned by the last fetch of `url` (if any)
+    modified - the Last-Modified validator returned by the last fetch of `url` (if any)
+    discover - whether to search HTML pages for an RSS link or meta redirect
+        when `url` is not a feed
+
+    Raises:
+        NotModified: If the validators indicate the feed has not changed
     """
-    feed = _parse_feed(url)
+    feed = _parse_feed(url, etag, modified, discover=discover)
     return (_podcast_data(feed), _episode_iter(feed))
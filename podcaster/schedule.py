@@ -0,0 +1,98 @@
+"""Adaptive scheduling of podcast feed refreshes
+"""
+from datetime import datetime, timedelta
+from random import random
+
+from dateutil.tz import tzutc
+
+
+def _utcnow():
+    """Return the current UTC time as a naive datetime (as stored in the db)
+    """
+    return datetime.now(tzutc()).replace(tzinfo=None)
+
+
+def _median(values):
+    """Return the median of the non-empty list `values`
+    """
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+class RefreshScheduler(object):
+    """Decide when a podcast's feed is next due to be checked.
+
+    The interval between checks is a fraction of the podcast's publishing
+    cadence, learned from the median gap between its most recent episodes.
+    Feeds that have gone quiet for longer than their cadence back off in
+    proportion to the silence. The interval is never shorter than the
+    lifetime the server allows the feed to be cached for, is clamped to
+    [min_interval, max_interval] and is randomly jittered so that feeds added
+    together do not stay due together.
+
+    min_interval, max_interval - timedelta bounds of the interval between checks
+    default_interval - the cadence assumed for feeds with fewer than 2 episodes
+    poll_fraction - the fraction of the cadence to wait between checks
+    jitter - the maximum relative amount by which an interval is perturbed
+    history - the number of most recent episodes used to learn the cadence
+    """
+    def __init__(self, min_interval=timedelta(minutes=30), max_interval=timedelta(days=7),
+                 default_interval=timedelta(days=1), poll_fraction=.5, jitter=.1,
+                 history=20):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.poll_fraction = poll_fraction
+        self.jitter = jitter
+        self.history = history
+
+    def cadence(self, published_dates):
+        """Return the median timedelta between consecutive dates in
+        `published_dates` (None if there are fewer than 2 dates)
+        """
+        dates = sorted(date for date in published_dates if date is not None)
+        dates = dates[-self.history:]
+        if len(dates) < 2:
+            return None
+        return _median([later - earlier for earlier, later in zip(dates, dates[1:])])
+
+    def interval(self, published_dates, cache_lifetime=None, now=None):
+        """Return the timedelta to wait before the next check (without jitter)
+
+        Args:
+            published_dates: The naive UTC publication datetimes of the
+                podcast's episodes
+            cache_lifetime: The number of seconds the server allows the feed
+                to be cached for (None if unspecified)
+            now: The naive UTC datetime of the check (defaults to now)
+        """
+        now = now or _utcnow()
+        cadence = self.cadence(published_dates) or self.default_interval
+        latest = max([date for date in published_dates if date is not None] or [None])
+        if latest is not None and now - latest > cadence:
+            cadence = now - latest
+        interval = timedelta(seconds=cadence.total_seconds() * self.poll_fraction)
+        if cache_lifetime:
+            interval = max(interval, timedelta(seconds=cache_lifetime))
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _jittered(self, interval):
+        """Return `interval` randomly perturbed by up to `jitter` of its length
+        """
+        return timedelta(seconds=interval.total_seconds() * (1 + self.jitter * (2 * random() - 1)))
+
+    def next_check(self, published_dates, cache_lifetime=None, now=None):
+        """Return the naive UTC datetime at which the podcast is next due to be
+        checked (see `interval`)
+        """
+        now = now or _utcnow()
+        return now + self._jittered(self.interval(published_dates, cache_lifetime, now))
+
+    def retry_check(self, now=None):
+        """Return the naive UTC datetime at which a podcast whose check failed
+        should be retried
+        """
+        return (now or _utcnow()) + self._jittered(self.min_interval)
@@ -3,22 +3,77 @@
 from podcaster.datetime_json import DatetimeEncoder, DatetimeDecoder
 
 import os
+import hashlib
 import json
+import shutil
+import stat
 from datetime import datetime
+from tempfile import mkstemp
 
 from dateutil.tz import tzutc
 
 
+_CHUNK_SIZE = 64 * 1024
+
+
 class InitializationError(BaseException):
     """Indicates initialization of the store failed
     """
     pass
 
 
+def _file_mode(path):
+    """Return the permission bits of the file at `path` or, if there is none,
+    those of a file newly created by `open`
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0666 & ~umask
+
+
+def _make_parent(path):
+    """Create the parent directory of `path` if it does not exist
+    """
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        # concurrent writers may race to create it
+        if not os.path.isdir(os.path.dirname(path)):
+            raise
+
+
+def _file_digest(path):
+    """Return the SHA-1 hex digest of the contents of the file at `path`
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_:
+        for block in iter(lambda: file_.read(_CHUNK_SIZE), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class SimplerFileStore(object):
     """A file store with no metadata
+
+    Each value is stored under a SHA-1 digest of its key, fanned out over two
+    levels of directories named by the digest's leading hex pairs (i.e.
+    `ab/cd/abcd...`) so that no directory grows too large.
+
+    If `dedupe` is set, values are also addressed by the digest of their
+    contents: each distinct content is stored once in the objects directory
+    and the path of each key holding it is a hard link to it.
+
+    Data that is still being written (e.g. an interrupted download) may be
+    staged in the store's partial directory until it is complete.
     """
-    def __init__(self, store_dir):
+    _PARTIAL_DIRNAME = '.partial'
+    _OBJECTS_DIRNAME = '.objects'
+
+    def __init__(self, store_dir, dedupe=False):
+        self.dedupe = dedupe
         try:
             self._store_dir = os.path.abspath(store_dir)
         except OSError:
@@ -44,14 +99,36 @@ class SimplerFileStore(object):
 
     @staticmethod
     def _key_to_fname(key):
-        """Return a valid file name for `key`
+        """Return a valid file name for `key` (stable across runs)
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    @staticmethod
+    def _shard_path(root, digest):
+        """Return the path of `digest` within the fan-out tree at `root`
         """
-        return str(hash(key))
+        return os.path.join(root, digest[:2], digest[2:4], digest)
 
     def _key_to_path(self, key):
         """Return the path for the value associate with `key`
         """
-        return os.path.join(self._store_dir, SimplerFileStore._key_to_fname(key))
+        return SimplerFileStore._shard_path(self._store_dir, SimplerFileStore._key_to_fname(key))
+
+    def _object_path(self, digest):
+        """Return the path of the deduplicated content with `digest`
+        """
+        return SimplerFileStore._shard_path(
+                os.path.join(self._store_dir, SimplerFileStore._OBJECTS_DIRNAME), digest)
+
+    def partial_path(self, key):
+        """Return the path at which partial data for `key` may be staged
+        """
+        path = os.path.join(self._store_dir, SimplerFileStore._PARTIAL_DIRNAME,
+                            SimplerFileStore._key_to_fname(key))
+        _make_parent(path)
+        return path
 
     def put(self, key, data):
         """Store a key mapped to some data
@@ -60,13 +137,54 @@ class SimplerFileStore(object):
         data - the data to be associated with `key`
             `data` may be a file open for reading.
             In this case, the _contents_ of `data` will be associated with `key`
+            (copied in chunks so that memory use is bounded)
         """
-        if isinstance(data, file):
-            return self.put(key, data.read())
-        if self.exists(key):
-            self.remove(key)
-        with open(self._key_to_path(key), 'wb') as data_file:
-            data_file.write(bytes(data))
+        fd, staged_path = mkstemp(dir=self._store_dir)
+        try:
+            with os.fdopen(fd, 'wb') as staged_file:
+                if isinstance(data, file):
+                    shutil.copyfileobj(data, staged_file, _CHUNK_SIZE)
+                else:
+                    staged_file.write(bytes(data))
+        except Exception:
+            os.remove(staged_path)
+            raise
+        return self.ingest(key, staged_path)
+
+    def ingest(self, key, path):
+        """Store a key mapped to the contents of the file at `path` by moving
+        the file into the store (an atomic rename when `path` is on the same
+        file system, e.g. a `partial_path`)
+
+        key - the string to be mapped to the file's contents
+        path - the path of the file to be moved into the store
+        """
+        key_path = self._key_to_path(key)
+        _make_parent(key_path)
+        self._unlink(key_path)
+        if not self.dedupe:
+            shutil.move(path, key_path)
+            return
+        object_path = self._object_path(_file_digest(path))
+        if os.path.exists(object_path):
+            os.remove(path)
+        else:
+            _make_parent(object_path)
+            shutil.move(path, object_path)
+        os.link(object_path, key_path)
+
+    def _unlink(self, path):
+        """Remove the file at `path` if it exists, along with its deduplicated
+        content if no other key holds it
+        """
+        if not os.path.exists(path):
+            return
+        # a deduplicated file's only other link is its content object
+        if self.dedupe and os.stat(path).st_nlink == 2:
+            object_path = self._object_path(_file_digest(path))
+            if os.path.exists(object_path) and os.path.samefile(path, object_path):
+                os.remove(object_path)
+        os.remove(path)
 
     def get_path(self, key):
         """If key is valid, return the file system path to the data file
@@ -80,7 +198,16 @@ class SimplerFileStore(object):
         key - the key to be removed from the store
         """
         if self.exists(key):
-            os.remove(self.get_path(key))
+            self._unlink(self.get_path(key))
+
+    def remove_path(self, path):
+        """Remove the value stored at `path` (e.g. one whose key is no longer
+        known). Paths outside of the store are ignored.
+
+        path - the path of the value to be removed
+        """
+        if os.path.abspath(path).startswith(self._store_dir + os.sep):
+            self._unlink(path)
 
     def exists(self, key):
         """Return whether the key `key` exists in the store
@@ -90,18 +217,42 @@ class SimplerFileStore(object):
 
 class SimpleFileStore(SimplerFileStore):
     """A file store with metadata stored in an on-disk JSON manifest
+
+    The manifest is persisted as a JSON snapshot plus an append-only journal
+    of the changes made since, one JSON record per line. Saving appends the
+    changes made since the last save to the journal, which is compacted into
+    a new snapshot (written to a temporary file and renamed into place) once
+    it holds more records than the snapshot has entries.
+
+    Unless opened with `validate` unset, the whole store is checked against
+    the manifest when it is opened. Otherwise the manifest is trusted and the
+    store may instead be checked incrementally by calls to `scrub`.
     """
     _MANIFEST_FNAME = '.manifest.json'
+    _JOURNAL_FNAME = '.manifest.journal'
+    _SCRUB_FNAME = '.scrub'
+    # the top-level directories of the fan-out tree in the order scrubbed
+    _SHARDS = ['%02x' % ind for ind in xrange(256)]
+    # the minimum number of journal records before compaction
+    COMPACT_MIN = 1000
 
-    def __init__(self, store_dir):
-        super(SimpleFileStore, self).__init__(store_dir)
+    def __init__(self, store_dir, dedupe=False, validate=True):
+        super(SimpleFileStore, self).__init__(store_dir, dedupe)
         self._manifest_fname = SimpleFileStore._MANIFEST_FNAME
         self._manifest_path = os.path.join(self._store_dir, self._manifest_fname)
+        self._journal_path = os.path.join(self._store_dir, SimpleFileStore._JOURNAL_FNAME)
+        self._scrub_path = os.path.join(self._store_dir, SimpleFileStore._SCRUB_FNAME)
         self._manifest = {}
+        # records of the changes yet to be saved, the number of records in the
+        # journal and the number of entries in the snapshot
+        self._pending = []
+        self._journal_len = 0
+        self._snapshot_len = 0
 
         self._load_dir()
         self._load_manifest()
-        self._validate()
+        if validate:
+            self._validate()
 
     def _load_manifest(self):
         """Load (and, if necessary, initialize) the store's manifest
@@ -115,37 +266,190 @@ class SimpleFileStore(SimplerFileStore):
                         'access permissions' % self._manifest_path)
         else:
             # If the manifest does not exist, write it out to file before loading it
-            self.save()
+            self.compact()
         with open(self._manifest_path, 'r') as manifest_file:
             try:
                 self._manifest = json.load(manifest_file, cls=DatetimeDecoder)
             except ValueError:
                 raise InitializationError('Corrupted manifest file')
+        self._snapshot_len = len(self._manifest)
+        self._replay_journal()
+
+    def _replay_journal(self):
+        """Apply the records of the journal to the loaded snapshot
+
+        A record torn by a crash mid-append was never saved, so it is cut from
+        the journal (rather than having later records appended onto it).
+        """
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, 'r+b') as journal_file:
+            records = journal_file.read()
+            complete = records.rfind('\n') + 1
+            if complete < len(records):
+                journal_file.truncate(complete)
+        for line in records[:complete].splitlines():
+            try:
+                record = json.loads(line, cls=DatetimeDecoder)
+            except ValueError:
+                # skip a corrupted record rather than losing those after it
+                continue
+            if record['op'] == 'put':
+                self._manifest[record['key']] = {'added': record['added'],
+                                                 'path': record['path']}
+            else:
+                self._manifest.pop(record['key'], None)
+            self._journal_len += 1
+
+    def _set_entry(self, key):
+        """Record the manifest entry of the value just stored for `key`
+        """
+        entry = {'added': datetime.now(tzutc()), 'path': self._key_to_path(key)}
+        self._manifest[key] = entry
+        self._pending.append({'op': 'put', 'key': key, 'added': entry['added'],
+                              'path': entry['path']})
+
+    def _discard_entry(self, key):
+        """Record the removal of the manifest entry for `key`
+        """
+        del self._manifest[key]
+        self._pending.append({'op': 'remove', 'key': key})
+
+    def _shard_of(self, path):
+        """Return the name of the top-level directory of the store holding `path`
+        """
+        return os.path.relpath(path, self._store_dir).split(os.sep)[0]
 
     def _validate(self):
         """Check for consistency between the loaded manifest and the backing store
         """
+        self._scrub_root()
+        self._scrub_shards(SimpleFileStore._SHARDS)
+
+    def _scrub_root(self):
+        """Check the files of the store outside of the fan-out tree
+        """
+        shards = set(SimpleFileStore._SHARDS)
         # Remove any manifest entries whose paths no longer exist
         paths = set()
         for key, entry in self._manifest.items():
-            if not os.path.exists(entry['path']):
-                del self._manifest[key]
-            paths.add(entry['path'])
+            if self._shard_of(entry['path']) not in shards:
+                if not os.path.exists(entry['path']):
+                    self._discard_entry(key)
+                paths.add(entry['path'])
         # Remove any unlisted files
+        skipped = shards | set([SimplerFileStore._PARTIAL_DIRNAME,
+                                SimplerFileStore._OBJECTS_DIRNAME,
+                                self._manifest_fname,
+                                SimpleFileStore._JOURNAL_FNAME,
+                                SimpleFileStore._SCRUB_FNAME])
         for fname in os.listdir(self._store_dir):
             path = os.path.join(self._store_dir, fname)
-            if path not in paths and fname != self._manifest_fname:
-                os.remove(path)
+            if fname in skipped:
+                continue
+            elif os.path.isdir(path):
+                self._scrub_tree(path, paths)
+            elif path not in paths:
+                self._unlink(path)
+
+    def _scrub_shards(self, shards):
+        """Check the files of the store under each of the top-level directories
+        of the fan-out tree named in `shards`
+        """
+        shards = set(shards)
+        # Remove any manifest entries whose paths no longer exist
+        paths = set()
+        for key, entry in self._manifest.items():
+            if self._shard_of(entry['path']) in shards:
+                if not os.path.exists(entry['path']):
+                    self._discard_entry(key)
+                paths.add(entry['path'])
+        # Remove any unlisted files
+        for shard in shards:
+            self._scrub_tree(os.path.join(self._store_dir, shard), paths)
+        # Remove any deduplicated content no longer held by a key
+        objects_dir = os.path.join(self._store_dir, SimplerFileStore._OBJECTS_DIRNAME)
+        for shard in shards:
+            for dirpath, _, fnames in os.walk(os.path.join(objects_dir, shard)):
+                for fname in fnames:
+                    path = os.path.join(dirpath, fname)
+                    if os.stat(path).st_nlink == 1:
+                        os.remove(path)
+
+    def _scrub_tree(self, root, paths):
+        """Remove the files under `root` not among the listed `paths`
+        """
+        for dirpath, _, fnames in os.walk(root):
+            for fname in fnames:
+                path = os.path.join(dirpath, fname)
+                if path not in paths:
+                    self._unlink(path)
+
+    def scrub(self, batch=16):
+        """Check the next `batch` top-level directories of the store for
+        consistency with the manifest, continuing from where the previous
+        call (even in an earlier run) left off
+
+        The manifest is saved before the progress of the scrub is recorded.
+
+        Return whether a full pass over the store has just been completed.
+        """
+        try:
+            with open(self._scrub_path, 'r') as scrub_file:
+                cursor = int(scrub_file.read())
+        except (IOError, ValueError):
+            cursor = 0
+        if cursor == 0:
+            self._scrub_root()
+        shards = SimpleFileStore._SHARDS[cursor:cursor + batch]
+        self._scrub_shards(shards)
+        cursor += len(shards)
+        done = cursor >= len(SimpleFileStore._SHARDS)
+        self.save()
+        with open(self._scrub_path, 'w') as scrub_file:
+            scrub_file.write(str(0 if done else cursor))
+        return done
 
     def save(self):
         """Save the file metadata to disk (i.e. recoverable when loaded again)
+
+        Only the changes made since the last save are written (appended to
+        the journal) unless the journal is due to be compacted.
+        """
+        if self._pending:
+            records = ''.join(json.dumps(record, cls=DatetimeEncoder) + '\n'
+                              for record in self._pending)
+            with open(self._journal_path, 'a') as journal_file:
+                journal_file.write(records)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self._journal_len += len(self._pending)
+            self._pending = []
+        if self._journal_len > max(self.COMPACT_MIN, self._snapshot_len):
+            self.compact()
+
+    def compact(self):
+        """Write the whole manifest to a new snapshot and empty the journal
         """
-        with open(self._manifest_path, 'w') as manifest_file:
+        fd, staged_path = mkstemp(dir=self._store_dir, prefix=self._manifest_fname)
+        with os.fdopen(fd, 'w') as manifest_file:
             json.dump(self._manifest, manifest_file, cls=DatetimeEncoder, sort_keys=True, indent=4)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        # mkstemp creates the file readable by its owner only
+        os.chmod(staged_path, _file_mode(self._manifest_path))
+        os.rename(staged_path, self._manifest_path)
+        self._snapshot_len = len(self._manifest)
+        # replaying records already in the snapshot is harmless, so a crash
+        # before the journal is emptied loses nothing
+        if os.path.exists(self._journal_path):
+            os.remove(self._journal_path)
+        self._journal_len = 0
+        self._pending = []
 
-    def put(self, key, data):
-        super(SimpleFileStore, self).put(key, data)
-        self._manifest[key] = {'added': datetime.now(tzutc()), 'path': self._key_to_path(key)}
+    def ingest(self, key, path):
+        super(SimpleFileStore, self).ingest(key, path)
+        self._set_entry(key)
 
     def get_path(self, key):
         """If key is valid, return the file system path to the data file
@@ -171,7 +475,18 @@ class SimpleFileStore(SimplerFileStore):
         """
         if self.exists(key):
             super(SimpleFileStore, self).remove(key)
-            del self._manifest[key]
+            self._discard_entry(key)
+
+    def remove_path(self, path):
+        """Remove the value stored at `path` along with its key (if any)
+
+        path - the path of the value to be removed
+        """
+        path = os.path.abspath(path)
+        for key, entry in self._manifest.items():
+            if entry['path'] == path:
+                self._discard_entry(key)
+        super(SimpleFileStore, self).remove_path(path)
 
     def exists(self, key):
         """Return whether the key `key` exists in the store
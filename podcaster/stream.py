@@ -0,0 +1,137 @@
+"""Serve a file that is still being downloaded to a media player over a
+loopback HTTP server
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import re
+import socket
+import threading
+import time
+
+
+_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'bytes=(\d+)-')
+
+
+class PartialFile(object):
+    """Read access to a file while it is being written by a download
+
+    Reads past the data written so far block until more arrives or the
+    download finishes. The file is opened once so that reads continue to
+    succeed after the completed file has been moved into the store.
+
+    path - the path of the file being written
+    is_complete - a function returning whether the download has finished
+    length - the expected length of the file (None if unknown)
+    poll_interval - the number of seconds between checks for more data
+    """
+    def __init__(self, path, is_complete, length=None, poll_interval=.1):
+        self.length = length
+        self.poll_interval = poll_interval
+        self._file = open(path, 'rb')
+        self._is_complete = is_complete
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def read(self, offset, size):
+        """Return up to `size` bytes from `offset`, blocking until they have
+        been written. An empty string indicates the end of the file (or that
+        the file has been closed).
+        """
+        while not self._closed:
+            complete = self._is_complete()
+            with self._lock:
+                if self._closed:
+                    break
+                self._file.seek(offset)
+                data = self._file.read(size)
+            if data or complete:
+                return data
+            time.sleep(self.poll_interval)
+        return ''
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            self._file.close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server handling each request on a daemon thread of its own
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """Ignore clients dropping their connections (e.g. the player when seeking)"""
+        pass
+
+
+class LoopbackServer(object):
+    """Context manager serving a `PartialFile` at `url` on the loopback
+    interface, with support for Range requests when its length is known
+    """
+    def __init__(self, partial_file):
+        self.partial_file = partial_file
+        self.url = None
+        self._server = None
+        self._thread = None
+
+    def _handler_cls(self):
+        """Return a request handler class serving `partial_file`
+        """
+        partial_file = self.partial_file
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                length = partial_file.length
+                match = _RANGE_RE.match(self.headers.get('Range', ''))
+                start = int(match.group(1)) if match and length is not None else 0
+                if length is not None and start and start >= length:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % length)
+                    self.end_headers()
+                    return
+                self.send_response(206 if start else 200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                if length is not None:
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('Content-Length', str(length - start))
+                    if start:
+                        self.send_header('Content-Range',
+                                         'bytes %d-%d/%d' % (start, length - 1, length))
+                self.end_headers()
+                offset = start
+                try:
+                    while True:
+                        data = partial_file.read(offset, _CHUNK_SIZE)
+                        if not data:
+                            break
+                        self.wfile.write(data)
+                        offset += len(data)
+                except socket.error:
+                    pass
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_cls())
+        self.url = 'http://127.0.0.1:%d/' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(.1,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        # unblock any reads in progress before stopping the server
+        self.partial_file.close()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -2,17 +2,44 @@ from podcaster.player import VLCPlayer
 from podcaster.controller import CmdLineController
 from podcaster.menu import build_data_rows, build_menu
 from podcaster.io import CmdLineIO
+from podcaster.downloads import PRIORITY_PLAY
 
 from operator import attrgetter
+import Queue
+import threading
 
 
 class ASCIIView(object):
     def __init__(self, controller, io_cls=CmdLineIO):
         self.controller = controller
         self._io = io_cls()
+        # messages from other threads, printed when the next menu is drawn
+        self._messages = Queue.Queue()
+        self._thread = threading.current_thread()
+
+    def _notify(self, message):
+        """Print `message` or, if called from a thread other than the one
+        running the menus, defer it until the next menu is drawn (so as not to
+        interrupt a prompt)
+        """
+        if threading.current_thread() is self._thread:
+            self._io.print_(message)
+        else:
+            self._messages.put(message)
+
+    def _print_messages(self):
+        """Print the messages deferred by `_notify`
+        """
+        while True:
+            try:
+                self._io.print_(self._messages.get_nowait())
+            except Queue.Empty:
+                break
 
     def _menu_action(self, page_text, actions):
+        self._print_messages()
         self._io.print_(page_text)
+        self.controller.checkpoint()
         choice = self._get_valid_choice(actions.keys())
         return actions[choice]
 
@@ -25,22 +52,29 @@ class ASCIIView(object):
             else:
                 return choice
 
-    def update(self, start=None, error=None, end=None):
+    def update(self, start=None, error=None, offline=None, podcast=None, end=None):
         """Alert user of status of update process.
 
         Args:
             start (bool): True if updating has begun
             error: A 2-tuple of the form (podcast_in_error, str_reason)
+            podcast: A Podcast whose background update has just completed
+            offline (int): The number of podcasts skipped because the internet
+                connection is down
             end (bool): True if updating has finished
         """
         if start:
-            self._io.print_('Updating Podcast Data...')
+            self._notify('Updating Podcast Data...')
         elif error is not None:
             podcast, reason = error
-            self._io.print_('Problem Updating "%s": %s' %
-                                    (podcast.name, reason))
+            self._notify('Problem Updating "%s": %s' % (podcast.name, reason))
+        elif offline:
+            self._notify('No connection: Skipped updating %d podcasts' % offline)
+        elif podcast is not None:
+            if podcast.has_update():
+                self._notify('New episodes of "%s"' % podcast.name)
         elif end:
-            self._io.print_('Finished Updating Podcast Data')
+            self._notify('Finished Updating Podcast Data')
 
     def add_podcast(self):
         while True:
@@ -64,9 +98,13 @@ class ASCIIView(object):
 
     def all_podcasts(self, podcasts):
         # Build menu data
-        new_series = ('New?',
-                        lambda podcast: '[X]' if podcast.has_update() else "[ ]",
-                        lambda f: f)
+        def new_marker(podcast):
+            """Return the 'New?' cell, marking podcasts still being updated
+            """
+            if self.controller.is_refresh_pending(podcast.id):
+                return '[~]'
+            return '[X]' if podcast.has_update() else "[ ]"
+        new_series = ('New?', new_marker, lambda f: f)
         name_series = ('Podcast',
                         attrgetter('name'),
                         lambda f: f)
@@ -78,8 +116,9 @@ class ASCIIView(object):
         other_actions = {
                 'a': ('Add a new podcast URL', self.controller.add_podcast),
                 'u': ('Update All Podcasts',
-                        lambda: self.controller.update_podcasts(cb_return_menu)),
+                        lambda: self.controller.update_podcasts(cb_return_menu, force=True)),
                 't': ('View Downloaded Episodes', self.controller.downloaded_episodes),
+                'r': ('Refresh Menu', cb_return_menu),
                 'q': ('Quit', None)
             }
         action_rows = [(cmd, desc) for cmd, (desc, _) in other_actions.iteritems()]
@@ -95,31 +134,49 @@ class ASCIIView(object):
 
         return self._menu_action(page_text, actions)
 
-    def episodes(self, podcast, episodes, episode_range):
+    def episodes(self, podcast, episodes, cursors):
+        """Menu listing a page of the episodes of a podcast
+
+        Args:
+            podcast: the Podcast whose episodes are listed
+            episodes: the Episode objects on the page
+            cursors: a 2-tuple of the form (prev_end, next_start) locating the
+                pages either side (see `Controller.episodes`)
+        """
+        prev_end, next_start = cursors
         date_series = ("Date",
                         attrgetter('date_published'),
                         lambda field: field.strftime('%m/%d'))
-        dld_series = ("DLD?",
-                        lambda episode: "[%s]" % ("X" if episode.local_file is not None else " "),
-                        lambda f: f)
+        def dld_marker(episode):
+            """Return the 'DLD?' cell, marking episodes still being downloaded
+            """
+            if episode.local_file is not None:
+                return '[X]'
+            return '[~]' if self.controller.download_ticket(episode.id) else '[ ]'
+        dld_series = ("DLD?", dld_marker, lambda f: f)
         title_series = ("Episode",
                         attrgetter('title'),
                         lambda f: f)
         to_key = lambda i: str(i + 1)
         data_rows = build_data_rows(to_key, episodes, date_series, dld_series, title_series)
         # Build menu actions
-        cb_return_menu = lambda p=podcast.id: self.controller.episodes(p, episode_range[0])
+        # the first episode of the page is the end of the previous one
+        cb_return_menu = lambda p=podcast.id: self.controller.episodes(p, start=prev_end)
         other_actions = {
                 'b': ('Back to All Podcasts', self.controller.all_podcasts),
                 'u': ('Update', lambda: self.controller.update_podcast(podcast.id, cb_return_menu)),
                 'd{n}': ('Delete an Episode', lambda: None),
+                'g{n}': ('Queue an Episode Download', lambda: None),
+                'k': ('Keep Newest Episodes Downloaded (now %d)' % (podcast.prefetch_count or 0),
+                        lambda p=podcast.id: self.set_prefetch_count(p, cb_return_menu)),
+                'r': ('Refresh Menu', cb_return_menu),
                 'q': ('Quit', None)
             }
-        next_func = lambda: self.controller.episodes(podcast.id, episode_range[1])
-        prev_func = lambda: self.controller.episodes(podcast.id, episode_range[0] - 10)
-        if episode_range[1] is not None:
+        next_func = lambda p=podcast.id: self.controller.episodes(p, start=next_start)
+        prev_func = lambda p=podcast.id: self.controller.episodes(p, end=prev_end)
+        if next_start is not None:
             other_actions['n'] = ('Next Page', next_func)
-        if episode_range[0] != 0:
+        if prev_end is not None:
             other_actions['p'] = ('Previous Page', prev_func)
         action_rows = [(cmd, desc) for cmd, (desc, _) in other_actions.iteritems()]
         # Build menu page
@@ -131,12 +188,36 @@ class ASCIIView(object):
             actions[to_key(ind)] = lambda e=eid: self.controller.play(e, cb_return_menu)
             actions['d' + to_key(ind)] = lambda e=eid:\
                                                 self.controller.delete_episode(e, cb_return_menu)
+            actions['g' + to_key(ind)] = lambda e=eid:\
+                                                self.queue_download(e, cb_return_menu)
         del other_actions['d{n}']
+        del other_actions['g{n}']
         for cmd, (_, action) in other_actions.iteritems():
             actions[cmd] = action
 
         return self._menu_action(page_text, actions)
 
+    def queue_download(self, episode_id, cb_return_menu):
+        """Queue an episode to be downloaded in the background
+        """
+        self.controller.queue_download(episode_id)
+        self._io.print_('Download queued (enter r to refresh the menu)')
+        return cb_return_menu
+
+    def set_prefetch_count(self, podcast_id, cb_return_menu):
+        """Prompt for the number of newest unplayed episodes of a podcast to
+        keep downloaded
+        """
+        while True:
+            count = self._io.input_('Number of episodes to keep downloaded (empty to cancel): ')
+            if not count:
+                break
+            elif count.isdigit():
+                self.controller.set_prefetch_count(podcast_id, int(count))
+                break
+            self._io.print_('Not a number: %s' % count)
+        return cb_return_menu
+
     def downloaded_episodes(self, episodes, podcasts):
         """Menu containing all episodes that are currently downloaded
 
@@ -207,26 +288,53 @@ class ASCIIView(object):
                 self._io.write('%d%% ' % (100 * ratio))
                 self._io.flush()
                 current_progress[0] += progress_step
-        error = self.controller.download_episode(episode.id, cb_progress)
+        ticket = self.controller.queue_download(episode.id, PRIORITY_PLAY, cb_progress)
+        error = ticket.wait()
         if error:
             self._io.print_('\nDownload failed: %s\n' % error)
         else:
             self._io.print_('\nDownload complete!\n')
         return not error
 
-    def play(self, podcast, episode, cb_return_menu):
-        """Launch the Player to play `episode`
+    def buffer(self, episode, ticket, is_buffered):
+        """Display the progress of downloading an episode until enough of it
+        has been buffered to start playback
+
+        Args:
+            episode: The Episode object being downloaded
+            ticket: The `downloads.DownloadTicket` of the download
+            is_buffered: A function returning whether enough has been buffered
+
+        Return:
+            On success (buffered or completed): True
+            On failure: False
+        """
+        self._io.print_('Buffering %s....' % episode.title)
+        while not ticket.is_done() and not is_buffered():
+            ticket.wait(.1)
+        if ticket.is_done() and ticket.error:
+            self._io.print_('\nDownload failed: %s\n' % ticket.error)
+            return False
+        return True
+
+    def play(self, podcast, episode, cb_return_menu, uri=None):
+        """Launch the Player to play `episode` (from `uri` if provided. Else,
+        from its downloaded file)
         """
         with VLCPlayer.init_no_log() as player:
-            player.change_media(episode.title, episode.local_file.uri)
+            player.change_media(episode.title, uri or episode.local_file.uri)
             def cb_update_position(player):
                 """Update the playback position periodically.
                 """
                 self.controller.update_episode_state(episode.id,
                         player.get_position(),
                         player.get_playback_rate())
+                if not player.is_playing():
+                    # save while paused in case playback is never resumed
+                    self.controller.save_episode_state()
             controller = CmdLineController(player, cb_update_position)
             controller.run(initial_rate=podcast.playback_rate,
                             initial_position=episode.last_position)
+            self.controller.save_episode_state()
 
         return cb_return_menu
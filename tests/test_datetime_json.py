@@ -5,6 +5,7 @@ from podcaster.datetime_json import DatetimeDecoder, DatetimeEncoder
 import unittest
 import json
 from datetime import datetime
+from dateutil.tz import tzutc, tzoffset
 
 
 class DatetimeDecoderTests(unittest.TestCase):
@@ -30,6 +31,14 @@ class DatetimeDecoderTests(unittest.TestCase):
         self.assertEquals(decoded_dict['Foo'], 'Hello World!')
         self.assertIsInstance(decoded_dict['Time'], datetime)
 
+    def test_round_trip(self):
+        dates = [datetime(2015, 1, 2, 3, 4, 5), datetime(2015, 1, 2, 3, 4, 5, 6),
+                 datetime(2015, 1, 2, 3, 4, 5, 6, tzinfo=tzutc()),
+                 datetime(2015, 1, 2, 3, 4, 5, tzinfo=tzoffset(None, 3600))]
+        for date in dates:
+            json_str = json.dumps({'Time': date}, cls=DatetimeEncoder)
+            self.assertEqual(json.loads(json_str, cls=DatetimeDecoder)['Time'], date)
+
 
 class DatetimeEncoderTests(unittest.TestCase):
     def test_without_date(self):
@@ -0,0 +1,70 @@
+"""Tests for the SQLite engine configuration
+"""
+from podcaster.db import sqlite_engine
+from tests.utils import TempDir
+
+import os
+import threading
+import unittest
+
+from sqlalchemy import event
+
+
+class SqliteEngineTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self.db_fname = os.path.abspath('test.db')
+
+    def tearDown(self):
+        self._temp_dir.exit()
+
+    def _in_thread(self, func):
+        """Return the result of calling `func` on another thread"""
+        results = []
+        thread = threading.Thread(target=lambda: results.append(func()))
+        thread.start()
+        thread.join(5)
+        return results[0] if results else None
+
+    def test_pragmas(self):
+        for engine in (sqlite_engine(self.db_fname), sqlite_engine()):
+            # NORMAL
+            self.assertEqual(engine.execute('PRAGMA synchronous').scalar(), 1)
+            self.assertEqual(engine.execute('PRAGMA busy_timeout').scalar(), 5000)
+            self.assertEqual(self._in_thread(
+                    lambda: engine.execute('PRAGMA busy_timeout').scalar()), 5000)
+
+    def test_wal(self):
+        engine = sqlite_engine(self.db_fname)
+        self.assertEqual(engine.execute('PRAGMA journal_mode').scalar(), 'wal')
+
+    def test_in_memory_shared(self):
+        engine = sqlite_engine()
+        engine.execute('CREATE TABLE foo (id INTEGER)')
+        engine.execute('INSERT INTO foo VALUES (1)')
+        self.assertEqual(self._in_thread(
+                lambda: engine.execute('SELECT COUNT(*) FROM foo').scalar()), 1)
+
+    def test_connection_reused(self):
+        for engine in (sqlite_engine(self.db_fname), sqlite_engine()):
+            connects = []
+            event.listen(engine, 'connect', lambda *args: connects.append(args))
+            for _ in xrange(3):
+                engine.execute('SELECT 1').scalar()
+            self._in_thread(lambda: engine.execute('SELECT 1').scalar())
+            self.assertLessEqual(len(connects), 1)
+
+    def test_read_during_write(self):
+        engine = sqlite_engine(self.db_fname)
+        engine.execute('CREATE TABLE foo (id INTEGER)')
+        engine.execute('INSERT INTO foo VALUES (1)')
+        writer = engine.connect()
+        transaction = writer.begin()
+        writer.execute('INSERT INTO foo VALUES (2)')
+        # the uncommitted write neither blocks nor is seen by a reader
+        self.assertEqual(self._in_thread(
+                lambda: engine.execute('SELECT COUNT(*) FROM foo').scalar()), 1)
+        transaction.commit()
+        writer.close()
+        self.assertEqual(engine.execute('SELECT COUNT(*) FROM foo').scalar(), 2)
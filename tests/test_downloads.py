@@ -0,0 +1,145 @@
+"""Tests for the download queue
+"""
+from podcaster.downloads import DownloadManager, PRIORITY_PLAY, PRIORITY_PREFETCH, \
+        PRIORITY_BACKFILL, in_window
+
+from datetime import datetime, time, timedelta
+import threading
+import unittest
+
+
+class _Downloads(object):
+    """Download function recording the order of downloads, each of which
+    blocks until released
+    """
+    def __init__(self):
+        self.started = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._release = threading.Event()
+        self._started = threading.Condition(self._lock)
+
+    def wait_started(self, count=1):
+        """Block until `count` downloads have started"""
+        with self._started:
+            while len(self.started) < count:
+                self._started.wait(5)
+
+    def release(self):
+        self._release.set()
+
+    def __call__(self, episode_id, cb_progress, priority):
+        with self._lock:
+            self.started.append(episode_id)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self._started.notify_all()
+        self._release.wait(5)
+        cb_progress(1.)
+        with self._lock:
+            self.active -= 1
+        return 'failed' if episode_id < 0 else None
+
+
+class DownloadManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.downloads = _Downloads()
+
+    def test_priority_order(self):
+        manager = DownloadManager(self.downloads, workers=1)
+        blocker = manager.enqueue(0, 'http://a.com/0.mp3')
+        self.downloads.wait_started()
+        tickets = [manager.enqueue(1, 'http://a.com/1.mp3', PRIORITY_BACKFILL),
+                   manager.enqueue(2, 'http://a.com/2.mp3', PRIORITY_PREFETCH),
+                   manager.enqueue(3, 'http://a.com/3.mp3', PRIORITY_BACKFILL)]
+        # raising the priority of a queued download moves it up the queue
+        manager.enqueue(3, 'http://a.com/3.mp3', PRIORITY_PREFETCH)
+        self.downloads.release()
+        for ticket in [blocker] + tickets:
+            self.assertIsNone(ticket.wait(5))
+        manager.stop()
+        self.assertListEqual(self.downloads.started, [0, 2, 3, 1])
+
+    def test_per_host_limit(self):
+        manager = DownloadManager(self.downloads, workers=4, per_host=1)
+        tickets = [manager.enqueue(ind, 'http://a.com/%d.mp3' % ind) for ind in xrange(3)]
+        tickets.append(manager.enqueue(3, 'http://b.com/3.mp3'))
+        self.downloads.wait_started(2)
+        self.assertListEqual(sorted(self.downloads.started), [0, 3])
+        self.downloads.release()
+        for ticket in tickets:
+            ticket.wait(5)
+        manager.stop()
+        self.assertEqual(self.downloads.max_active, 2)
+
+    def test_play_not_queued(self):
+        manager = DownloadManager(self.downloads, workers=1)
+        manager.enqueue(0, 'http://a.com/0.mp3')
+        self.downloads.wait_started()
+        manager.enqueue(1, 'http://a.com/1.mp3')
+        progress = []
+        ticket = manager.enqueue(2, 'http://a.com/2.mp3', PRIORITY_PLAY, progress.append)
+        self.downloads.release()
+        self.assertIsNone(ticket.wait(5))
+        manager.stop()
+        self.assertListEqual(progress, [1.])
+        self.assertListEqual(self.downloads.started[:2], [0, 2])
+
+    def test_duplicate_enqueue(self):
+        manager = DownloadManager(self.downloads, workers=1)
+        ticket = manager.enqueue(0, 'http://a.com/0.mp3')
+        self.assertIs(manager.enqueue(0, 'http://a.com/0.mp3'), ticket)
+        self.assertIs(manager.ticket(0), ticket)
+        self.downloads.release()
+        ticket.wait(5)
+        manager.stop()
+        self.assertIsNone(manager.ticket(0))
+        self.assertListEqual(self.downloads.started, [0])
+
+    def test_failure(self):
+        manager = DownloadManager(self.downloads, workers=1)
+        self.downloads.release()
+        self.assertEqual(manager.enqueue(-1, 'http://a.com/1.mp3').wait(5), 'failed')
+        manager.stop()
+
+    def test_exception(self):
+        def download(episode_id, cb_progress, priority):
+            raise ValueError('boom')
+        manager = DownloadManager(download, workers=1)
+        self.assertEqual(manager.enqueue(0, 'http://a.com/0.mp3').wait(5), 'boom')
+        # the worker survives to run the next download
+        self.assertEqual(manager.enqueue(1, 'http://a.com/1.mp3').wait(5), 'boom')
+        manager.stop()
+
+    def test_backfill_window(self):
+        now = datetime.now()
+        closed = ((now + timedelta(hours=1)).time(), (now + timedelta(hours=2)).time())
+        manager = DownloadManager(self.downloads, workers=1, backfill_window=closed)
+        self.downloads.release()
+        backfill = manager.enqueue(0, 'http://a.com/0.mp3', PRIORITY_BACKFILL)
+        self.assertIsNone(manager.enqueue(1, 'http://a.com/1.mp3', PRIORITY_PREFETCH).wait(5))
+        self.assertFalse(backfill.is_done())
+        # raising the priority lifts the restriction
+        manager.enqueue(0, 'http://a.com/0.mp3', PRIORITY_PREFETCH)
+        self.assertIsNone(backfill.wait(5))
+        manager.stop()
+        self.assertListEqual(self.downloads.started, [1, 0])
+
+
+class InWindowTests(unittest.TestCase):
+    def test_in_window(self):
+        window = (time(1), time(6))
+        self.assertTrue(in_window(window, datetime(2015, 1, 1, 3)))
+        self.assertFalse(in_window(window, datetime(2015, 1, 1, 6)))
+        self.assertFalse(in_window(window, datetime(2015, 1, 1, 23)))
+
+    def test_wrapping_window(self):
+        window = (time(22), time(6))
+        self.assertTrue(in_window(window, datetime(2015, 1, 1, 23)))
+        self.assertTrue(in_window(window, datetime(2015, 1, 1, 2)))
+        self.assertFalse(in_window(window, datetime(2015, 1, 1, 12)))
+
+    def test_no_window(self):
+        self.assertTrue(in_window(None))
+
@@ -0,0 +1,338 @@
+"""Tests for the HTTP client
+"""
+from podcaster.http import HTTPClient, ConnectivityMonitor, ResponseError, cache_lifetime, \
+                            RESUME_SUFFIX, INTERACTIVE, BACKGROUND, bandwidth
+from podcaster import http
+from tests.utils import TempDir, LocalHTTPServer
+
+import os
+import threading
+import time
+import unittest
+import zlib
+from gzip import GzipFile
+from StringIO import StringIO
+
+
+def _gzip(data):
+    buf = StringIO()
+    with GzipFile(fileobj=buf, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+class HTTPClientTests(unittest.TestCase):
+    def setUp(self):
+        self.client = HTTPClient(timeout=2)
+        self.server = LocalHTTPServer({
+                '/a': (200, {}, 'foo'),
+                '/b': (200, {}, 'bar'),
+                '/gzip': (200, {'Content-Encoding': 'gzip'}, _gzip('foo')),
+                '/deflate': (200, {'Content-Encoding': 'deflate'}, zlib.compress('foo')),
+                '/redirect': (302, {'Location': '/a'}, ''),
+                '/loop': (302, {'Location': '/loop'}, ''),
+                '/missing': (404, {}, 'nope'),
+                '/not_modified': (304, {'ETag': '"v"'}, ''),
+        })
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.__exit__(None, None, None)
+
+    def test_fetch(self):
+        response = self.client.fetch(self.server.url('/a'))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, 'foo')
+        self.assertEqual(response.url, self.server.url('/a'))
+
+    def test_keep_alive(self):
+        for path in ('/a', '/b', '/a'):
+            self.client.fetch(self.server.url(path))
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_connection(self):
+        self.client.fetch(self.server.url('/a'))
+        for conns in self.client._idle.itervalues():
+            for conn in conns:
+                conn.sock.close()
+        self.assertEqual(self.client.fetch(self.server.url('/b')).body, 'bar')
+
+    def test_content_encoding(self):
+        for path in ('/gzip', '/deflate'):
+            response = self.client.fetch(self.server.url(path))
+            self.assertEqual(response.body, 'foo')
+            self.assertNotIn('content-encoding', response.headers)
+        self.assertEqual(self.server.requests[0][1]['accept-encoding'], 'gzip, deflate')
+
+    def test_redirect(self):
+        response = self.client.fetch(self.server.url('/redirect'))
+        self.assertEqual(response.body, 'foo')
+        self.assertEqual(response.url, self.server.url('/a'))
+        with self.assertRaises(ResponseError):
+            self.client.fetch(self.server.url('/loop'))
+
+    def test_error_status(self):
+        with self.assertRaises(ResponseError):
+            self.client.fetch(self.server.url('/missing'))
+        self.assertEqual(self.client.fetch(self.server.url('/a')).body, 'foo')
+
+    def test_not_modified(self):
+        response = self.client.fetch(self.server.url('/not_modified'), {'If-None-Match': '"v"'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.body, '')
+
+    def test_bad_url(self):
+        with self.assertRaises(ResponseError):
+            self.client.fetch('ftp://example.com/foo')
+
+    @TempDir.decorator
+    def test_download_to_file(self):
+        blocks = []
+        fname, _ = self.client.download_to_file(self.server.url('/a'), 'foo',
+                                                lambda *args: blocks.append(args))
+        self.assertEqual(open(fname).read(), 'foo')
+        self.assertEqual(blocks[-1][2], 3)
+
+
+class ResumableDownloadTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self.client = HTTPClient(timeout=2)
+        self.content = 'abcdef'
+        self.etag = '"v1"'
+        self.truncate = 3
+        self.server = LocalHTTPServer({'/episode': self._route})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.__exit__(None, None, None)
+        self._temp_dir.exit()
+
+    def _route(self, headers):
+        """Serve `content`, honoring Range requests whose If-Range matches, and
+        dropping the connection after `truncate` bytes (if set)
+        """
+        headers_ = {'ETag': self.etag, 'Accept-Ranges': 'bytes'}
+        start = 0
+        if 'range' in headers and headers.get('if-range') == self.etag:
+            start = int(headers['range'].split('=')[1].rstrip('-'))
+        body = self.content[start:]
+        status = 206 if start else 200
+        if start:
+            headers_['Content-Range'] = 'bytes %d-%d/%d' % (start, len(self.content) - 1,
+                                                            len(self.content))
+        if self.truncate is not None:
+            headers_['Content-Length'] = str(len(body))
+            headers_['Connection'] = 'close'
+            body = body[:self.truncate]
+        return (status, headers_, body)
+
+    def _download(self):
+        return self.client.download_to_file(self.server.url('/episode'), 'foo', resume=True)
+
+    def test_resume(self):
+        with self.assertRaises(ResponseError):
+            self._download()
+        self.assertEqual(open('foo').read(), 'abc')
+        self.assertTrue(os.path.exists('foo' + RESUME_SUFFIX))
+        self.truncate = None
+        self._download()
+        self.assertEqual(self.server.requests[-1][1]['range'], 'bytes=3-')
+        self.assertEqual(open('foo').read(), self.content)
+        self.assertFalse(os.path.exists('foo' + RESUME_SUFFIX))
+
+    def test_validator_changed(self):
+        with self.assertRaises(ResponseError):
+            self._download()
+        self.truncate = None
+        self.etag = '"v2"'
+        self.content = 'ghijkl'
+        self._download()
+        self.assertEqual(open('foo').read(), 'ghijkl')
+
+    def test_weak_etag(self):
+        self.etag = 'W/"v1"'
+        with self.assertRaises(ResponseError):
+            self._download()
+        self.truncate = None
+        self._download()
+        # a weak validator cannot be used with If-Range so the download restarts
+        self.assertNotIn('range', self.server.requests[-1][1])
+        self.assertEqual(open('foo').read(), self.content)
+
+    def test_no_resume(self):
+        with self.assertRaises(ResponseError):
+            self._download()
+        self.truncate = None
+        self.client.download_to_file(self.server.url('/episode'), 'foo')
+        self.assertNotIn('range', self.server.requests[-1][1])
+        self.assertEqual(open('foo').read(), self.content)
+
+
+class SegmentedDownloadTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self._min_segment_size = http.MIN_SEGMENT_SIZE
+        http.MIN_SEGMENT_SIZE = 1024
+        self.client = HTTPClient(timeout=2)
+        self.content = ''.join(chr(ind % 251) for ind in xrange(10000))
+        self.headers = {'ETag': '"v1"', 'Accept-Ranges': 'bytes'}
+        self.honor_ranges = True
+        self.server = LocalHTTPServer({'/episode': self._route})
+        self.server.__enter__()
+
+    def tearDown(self):
+        http.MIN_SEGMENT_SIZE = self._min_segment_size
+        self.client.close()
+        self.server.__exit__(None, None, None)
+        self._temp_dir.exit()
+
+    def _route(self, headers):
+        """Serve `content`, honoring closed Range requests whose If-Range matches
+        (if `honor_ranges`)
+        """
+        headers_ = dict(self.headers)
+        if self.honor_ranges and 'range' in headers and \
+                headers.get('if-range') == headers_.get('ETag'):
+            start, end = [int(pos) for pos in headers['range'].split('=')[1].split('-')]
+            headers_['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(self.content))
+            return (206, headers_, self.content[start:end + 1])
+        return (200, headers_, self.content)
+
+    def _ranges(self):
+        return [headers['range'] for _, headers in self.server.requests if 'range' in headers]
+
+    def test_segmented(self):
+        progress = []
+        self.client.download_to_file(self.server.url('/episode'), 'foo', segments=4,
+                reporthook=lambda num, size, total: progress.append(1. * num * size / total))
+        self.assertEqual(open('foo', 'rb').read(), self.content)
+        self.assertItemsEqual(self._ranges(), ['bytes=2500-4999', 'bytes=5000-7499',
+                                               'bytes=7500-9999'])
+        self.assertEqual(max(progress), 1.)
+
+    def test_no_accept_ranges(self):
+        del self.headers['Accept-Ranges']
+        self.client.download_to_file(self.server.url('/episode'), 'foo', segments=4)
+        self.assertEqual(open('foo', 'rb').read(), self.content)
+        self.assertListEqual(self._ranges(), [])
+
+    def test_too_small(self):
+        self.client.download_to_file(self.server.url('/episode'), 'foo', segments=20)
+        self.assertEqual(open('foo', 'rb').read(), self.content)
+        self.assertListEqual(self._ranges(), [])
+
+    def test_range_ignored(self):
+        self.honor_ranges = False
+        with self.assertRaises(ResponseError):
+            self.client.download_to_file(self.server.url('/episode'), 'foo', segments=4)
+
+
+class BandwidthLimiterTests(unittest.TestCase):
+    SIZE = 256 * 1024
+    RATE = 512 * 1024
+
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self.client = HTTPClient(timeout=2)
+        self.server = LocalHTTPServer({'/episode': (200, {}, 'x' * self.SIZE)})
+        self.server.__enter__()
+
+    def tearDown(self):
+        bandwidth.set_rate(INTERACTIVE, None)
+        bandwidth.set_rate(BACKGROUND, None)
+        self.client.close()
+        self.server.__exit__(None, None, None)
+        self._temp_dir.exit()
+
+    def _timed_downloads(self, *budgets):
+        """Return the number of seconds taken to download the episode once
+        with each of `budgets` concurrently
+        """
+        threads = [threading.Thread(target=self.client.download_to_file,
+                                    args=(self.server.url('/episode'), str(ind)),
+                                    kwargs={'budget': budget})
+                    for ind, budget in enumerate(budgets)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    def test_unlimited(self):
+        self.assertLess(self._timed_downloads(INTERACTIVE), .25)
+
+    def test_rate(self):
+        bandwidth.set_rate(BACKGROUND, self.RATE, burst=8192)
+        elapsed = self._timed_downloads(BACKGROUND)
+        self.assertGreater(elapsed, .4)
+        self.assertLess(elapsed, 1.)
+
+    def test_rate_shared(self):
+        bandwidth.set_rate(BACKGROUND, self.RATE, burst=8192)
+        self.assertGreater(self._timed_downloads(BACKGROUND, BACKGROUND), .9)
+
+    def test_budgets_separate(self):
+        bandwidth.set_rate(INTERACTIVE, self.RATE, burst=8192)
+        bandwidth.set_rate(BACKGROUND, self.RATE, burst=8192)
+        self.assertLess(self._timed_downloads(INTERACTIVE, BACKGROUND), .9)
+
+
+class ConnectivityMonitorTests(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalHTTPServer({'/': (200, {}, 'ok')})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+
+    def test_online(self):
+        monitor = ConnectivityMonitor(self.server.url('/'), ttl=60, timeout=1)
+        self.assertTrue(monitor.is_online())
+        self.assertFalse(monitor.offline)
+
+    def test_offline(self):
+        monitor = ConnectivityMonitor('http://127.0.0.1:1/', ttl=60, timeout=1)
+        self.assertFalse(monitor.is_online())
+        self.assertTrue(monitor.offline)
+        monitor.report_online()
+        self.assertTrue(monitor.is_online())
+
+    def test_cached(self):
+        monitor = ConnectivityMonitor(self.server.url('/'), ttl=60, timeout=1)
+        for _ in xrange(3):
+            monitor.is_online()
+        self.assertEqual(len(self.server.requests), 1)
+        monitor.invalidate()
+        monitor.is_online()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_expired(self):
+        monitor = ConnectivityMonitor(self.server.url('/'), ttl=0, timeout=1)
+        monitor.is_online()
+        time.sleep(.01)
+        monitor.is_online()
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class CacheLifetimeTests(unittest.TestCase):
+    def test_max_age(self):
+        self.assertEqual(cache_lifetime({'cache-control': 'public, max-age=600'}), 600)
+
+    def test_no_cache(self):
+        self.assertEqual(cache_lifetime({'cache-control': 'no-cache'}), 0)
+
+    def test_expires(self):
+        headers = {'date': 'Mon, 01 Jun 2015 00:00:00 GMT',
+                   'expires': 'Mon, 01 Jun 2015 01:00:00 GMT'}
+        self.assertEqual(cache_lifetime(headers), 3600)
+
+    def test_unspecified(self):
+        self.assertIsNone(cache_lifetime({}))
+        self.assertIsNone(cache_lifetime({'expires': 'garbage'}))
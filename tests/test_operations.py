@@ -0,0 +1,699 @@
+"""Tests for the Controller operations
+"""
+from podcaster.model import Podcast, Episode, EpisodeFile, Download
+from podcaster.operations import Controller
+from podcaster.http import default_client, connectivity, ConnectionError
+from podcaster.rss import PodcastData
+from podcaster.view import ASCIIView
+from podcaster.downloads import DownloadManager
+from podcaster import rss
+from tests.utils import LocalHTTPServer, ControllerTestCase, count_queries, \
+        assert_max_queries, rss_feed, RSS_HEADERS
+
+import gc
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+
+def _feed(num_episodes, updated=None, offset=0):
+    """Return a fetched feed tuple of the form (podcast_data, episode_tuples)
+    containing `num_episodes` episodes
+    """
+    if updated is None:
+        updated = datetime.now(tzutc()) + timedelta(days=1)
+    base = datetime(2015, 1, 1, tzinfo=tzutc())
+    episodes = [('http://example.com/%d.mp3' % ind, 'Episode %d' % ind, '',
+                    base + timedelta(days=ind))
+                for ind in xrange(offset, offset + num_episodes)]
+    data = PodcastData('Foo', 'http://example.com/rss', updated, '', '', '', None, None,
+                        ('http://example.com/rss',), None)
+    return (data, list(reversed(episodes)))
+
+
+class UpdatePodcastTests(ControllerTestCase):
+    def _titles(self):
+        with self.controller.session() as session:
+            return set(title for title, in session.query(Episode.title))
+
+    def test_new_episodes(self):
+        self.update(_feed(3))
+        self.assertSetEqual(self._titles(), set(['Episode 0', 'Episode 1', 'Episode 2']))
+
+    def test_absent_episodes(self):
+        self.update(_feed(3))
+        self.update(_feed(2, offset=1))
+        self.assertSetEqual(self._titles(), set(['Episode 1', 'Episode 2']))
+
+    def test_absent_episode_file(self):
+        self.update(_feed(1))
+        with self.controller.session() as session:
+            episode = session.query(Episode).one()
+            episode.local_file = EpisodeFile(episode_id=episode.id, uri='file:///foo')
+        self.update(_feed(1, offset=1))
+        with self.controller.session() as session:
+            self.assertIsNone(session.query(EpisodeFile).one().episode_id)
+
+    def test_existing_episodes_kept(self):
+        self.update(_feed(2))
+        with self.controller.session() as session:
+            ids = set(id_ for id_, in session.query(Episode.id))
+        self.update(_feed(3))
+        with self.controller.session() as session:
+            self.assertTrue(ids < set(id_ for id_, in session.query(Episode.id)))
+
+    def test_duplicate_entries(self):
+        data, episodes = _feed(2)
+        self.update((data, episodes + episodes))
+        with self.controller.session() as session:
+            self.assertEqual(session.query(Episode).count(), 2)
+
+    def test_identity_unique(self):
+        self.update(_feed(1))
+        with self.controller.session() as session:
+            episode = session.query(Episode).one()
+            session.add(Episode(podcast_id=self.podcast_id, title=episode.title,
+                                url=episode.url, date_published=episode.date_published))
+            self.assertRaises(IntegrityError, session.flush)
+            session.rollback()
+
+    def test_not_updated(self):
+        self.update(_feed(2, updated=datetime(1999, 1, 1, tzinfo=tzutc())))
+        self.assertSetEqual(self._titles(), set())
+
+    def test_query_count_constant(self):
+        counts = []
+        for size in (10, 1200):
+            self.update(_feed(size))
+            with count_queries(self.controller._engine) as statements:
+                self.update(_feed(size, offset=size))
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_schedule(self):
+        self.update(_feed(3))
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(self.podcast_id)
+            self.controller._schedule(podcast, None)
+            self.assertGreater(podcast.next_check, datetime.now(tzutc()).replace(tzinfo=None))
+            self.assertEqual(self.controller._due_podcasts(Podcast).count(), 0)
+            podcast.next_check = None
+            self.assertEqual(self.controller._due_podcasts(Podcast).count(), 1)
+
+
+class _PrintIO(object):
+    """IO recording the lines printed"""
+    def __init__(self):
+        self.lines = []
+
+    def print_(self, *args):
+        self.lines.append(' '.join(map(str, args)))
+
+
+class _MenuView(ASCIIView):
+    """View printing each menu and choosing to quit"""
+    def __init__(self, controller):
+        super(_MenuView, self).__init__(controller, io_cls=_PrintIO)
+
+    def _get_valid_choice(self, valid_choices):
+        return 'q'
+
+
+class _UpdateView(object):
+    """View recording the updates reported"""
+    def __init__(self):
+        self.updates = []
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+class RefreshTests(ControllerTestCase):
+    """Refresh podcasts from feeds served locally
+    """
+    def setUp(self):
+        super(RefreshTests, self).setUp()
+        self.server = LocalHTTPServer({'/feed': (200, RSS_HEADERS, rss_feed())})
+        self.server.__enter__()
+        self.controller.view = _UpdateView()
+        self._point_at(self.podcast_id, '/feed')
+
+    def tearDown(self):
+        default_client.close()
+        self.server.__exit__(None, None, None)
+        super(RefreshTests, self).tearDown()
+
+    def _point_at(self, podcast_id, path):
+        """Set the feed of the podcast to `path` on the server"""
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(podcast_id)
+            podcast.rss_url = podcast.source_url = self.server.url(path)
+
+    def _add_podcast(self, name, path):
+        """Add a podcast whose feed is `path` on the server, returning its id"""
+        with self.controller.session() as session:
+            podcast = Podcast(name=name, rss_url=self.server.url(path),
+                              source_url=self.server.url(path),
+                              last_updated=datetime(2000, 1, 1))
+            session.add(podcast)
+            session.flush()
+            return podcast.id
+
+    def _titles(self, podcast_id):
+        with self.controller.session() as session:
+            return set(title for title, in session.query(Episode.title)
+                                                  .filter_by(podcast_id=podcast_id))
+
+    @staticmethod
+    def _wait_for(predicate, timeout=5):
+        """Return whether `predicate` became true within `timeout` seconds"""
+        deadline = time.time() + timeout
+        while not predicate():
+            if time.time() > deadline:
+                return False
+            time.sleep(.01)
+        return True
+
+    def test_conditional_get(self):
+        versions = {'current': ('"v1"', 'Mon, 01 Jun 2015 00:00:00 GMT')}
+        def feed(headers):
+            etag, modified = versions['current']
+            if headers.get('if-none-match') == etag:
+                return (304, {}, '')
+            return (200, dict(RSS_HEADERS, **{'ETag': etag, 'Last-Modified': modified}),
+                    rss_feed())
+        self.server.routes['/feed'] = feed
+        parses = []
+        parse = rss.feedparser.parse
+        def counting_parse(*args, **kwargs):
+            parses.append(args)
+            return parse(*args, **kwargs)
+        rss.feedparser.parse = counting_parse
+        try:
+            self.controller.update_podcast(self.podcast_id, None)
+            self.assertNotIn('if-none-match', self.server.requests[-1][1])
+            with self.controller.session() as session:
+                podcast = session.query(Podcast).get(self.podcast_id)
+                self.assertEqual(podcast.etag, '"v1"')
+                self.assertEqual(podcast.last_modified, 'Mon, 01 Jun 2015 00:00:00 GMT')
+            del parses[:]
+            with count_queries(self.controller._engine) as statements:
+                self.controller.update_podcast(self.podcast_id, None)
+            headers = self.server.requests[-1][1]
+            self.assertEqual(headers['if-none-match'], '"v1"')
+            self.assertEqual(headers['if-modified-since'], 'Mon, 01 Jun 2015 00:00:00 GMT')
+            # a 304 is neither parsed nor reconciled against the stored episodes
+            self.assertListEqual(parses, [])
+            self.assertFalse(any('episodes.title' in statement or
+                                 statement.split(None, 1)[0] in ('INSERT', 'DELETE')
+                                 for statement in statements))
+            versions['current'] = ('"v2"', 'Tue, 02 Jun 2015 00:00:00 GMT')
+            self.controller.update_podcast(self.podcast_id, None)
+            self.assertEqual(len(parses), 1)
+        finally:
+            rss.feedparser.parse = parse
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(self.podcast_id)
+            self.assertEqual(podcast.etag, '"v2"')
+            self.assertEqual(podcast.last_modified, 'Tue, 02 Jun 2015 00:00:00 GMT')
+
+    def _resolved(self, rss_path, resolved_at):
+        """Point the podcast at the HTML page '/page' linking to '/feed' and
+        cache `rss_path` as its feed URL, resolved at `resolved_at`
+        """
+        self.server.routes['/page'] = (
+                200, {'Content-Type': 'text/html'},
+                '<html><head><link rel="alternate" type="application/rss+xml" '
+                'href="/feed"></head></html>')
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(self.podcast_id)
+            podcast.source_url = self.server.url('/page')
+            podcast.rss_url = self.server.url(rss_path)
+            podcast.resolved_at = resolved_at
+
+    def _feed_url(self):
+        with self.controller.session() as session:
+            return session.query(Podcast).get(self.podcast_id).rss_url
+
+    def test_cached_feed_url(self):
+        self._resolved('/feed', datetime.now(tzutc()).replace(tzinfo=None))
+        self.controller.update_podcast(self.podcast_id, None)
+        self.assertListEqual([path for path, _ in self.server.requests], ['/feed'])
+        self.assertSetEqual(self._titles(self.podcast_id), set(['Episode 0', 'Episode 1']))
+
+    def test_cached_feed_url_failed(self):
+        self._resolved('/gone', datetime.now(tzutc()).replace(tzinfo=None))
+        self.controller.update_podcast(self.podcast_id, None)
+        # the user's URL is resolved again once the cached one stops working
+        self.assertListEqual([path for path, _ in self.server.requests],
+                             ['/gone', '/page', '/feed'])
+        self.assertSetEqual(self._titles(self.podcast_id), set(['Episode 0', 'Episode 1']))
+        self.assertEqual(self._feed_url(), self.server.url('/feed'))
+
+    def test_cached_feed_url_failed_unresolved(self):
+        self._point_at(self.podcast_id, '/gone')
+        with self.controller.session() as session:
+            session.query(Podcast).get(self.podcast_id).resolved_at = \
+                    datetime.now(tzutc()).replace(tzinfo=None)
+        self.controller.update_podcast(self.podcast_id, None)
+        # the user's URL is the feed URL so it is not fetched again
+        self.assertListEqual([path for path, _ in self.server.requests], ['/gone'])
+        self.assertTrue(any('error' in update for update in self.controller.view.updates))
+
+    def test_cached_feed_url_expired(self):
+        self._resolved('/feed', datetime(2000, 1, 1))
+        self.controller.update_podcast(self.podcast_id, None)
+        self.assertListEqual([path for path, _ in self.server.requests], ['/page', '/feed'])
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(self.podcast_id)
+            self.assertFalse(podcast.needs_resolution(self.controller._resolve_ttl))
+
+    def test_offline(self):
+        self._add_podcast('Bar', '/feed')
+        state = (connectivity.offline, connectivity._checked_at)
+        connectivity.offline, connectivity._checked_at = True, time.time()
+        try:
+            self.controller.update_podcasts(None)
+            self.controller.update_podcasts_async().join(5)
+        finally:
+            connectivity.offline, connectivity._checked_at = state
+        self.assertListEqual(self.server.requests, [])
+        self.assertListEqual([update['offline'] for update in self.controller.view.updates
+                              if 'offline' in update], [2, 2])
+        self.assertFalse(any('error' in update for update in self.controller.view.updates))
+        # the skipped podcasts are still due
+        with self.controller.session() as session:
+            self.assertEqual(self.controller._due_podcasts(Podcast).count(), 2)
+
+    def test_offline_worker(self):
+        with self.controller.session() as session:
+            job = self.controller._refresh_job(session.query(Podcast).get(self.podcast_id))
+        state = (connectivity.offline, connectivity._checked_at)
+        connectivity.offline = True
+        try:
+            podcast_id, feed, error = self.controller._fetch_podcast(job)
+        finally:
+            connectivity.offline, connectivity._checked_at = state
+        self.assertEqual(podcast_id, self.podcast_id)
+        self.assertIsNone(feed)
+        self.assertIsInstance(error, ConnectionError)
+        self.assertListEqual(self.server.requests, [])
+
+    def test_concurrent_slow_and_failing(self):
+        released = threading.Event()
+        def slow_feed(headers):
+            released.wait(5)
+            return (200, RSS_HEADERS, rss_feed('Slow', num_episodes=3))
+        self.server.routes['/slow'] = slow_feed
+        self.server.routes['/broken'] = (500, {}, '')
+        slow_id = self._add_podcast('Slow', '/slow')
+        broken_id = self._add_podcast('Broken', '/broken')
+        writers = set()
+        def cb_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+                writers.add(threading.current_thread())
+        event.listen(self.controller._engine, 'before_cursor_execute', cb_execute)
+        try:
+            thread = self.controller.update_podcasts_async()
+            updates = self.controller.view.updates
+            # the other feeds are applied and reported while the slow one is in flight
+            self.assertTrue(self._wait_for(lambda: len(updates) >= 3))
+            self.assertSetEqual(self._titles(self.podcast_id),
+                                set(['Episode 0', 'Episode 1']))
+            self.assertTrue(self.controller.is_refresh_pending(slow_id))
+            errors = [update['error'] for update in updates if 'error' in update]
+            self.assertListEqual([podcast.id for podcast, _ in errors], [broken_id])
+            self.assertIn('500', errors[0][1])
+            released.set()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            released.set()
+            event.remove(self.controller._engine, 'before_cursor_execute', cb_execute)
+        self.assertSetEqual(self._titles(slow_id),
+                            set(['Episode 0', 'Episode 1', 'Episode 2']))
+        # all writes are made by the thread applying the updates, none by the workers
+        self.assertSetEqual(writers, set([thread]))
+
+    def test_async_in_memory(self):
+        thread = self.controller.update_podcasts_async()
+        self.assertTrue(self.controller.is_refresh_pending(self.podcast_id))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertSetEqual(self._titles(self.podcast_id), set(['Episode 0', 'Episode 1']))
+        self.assertFalse(self.controller.is_refresh_pending(self.podcast_id))
+        self.assertListEqual([update['podcast'].id for update in self.controller.view.updates],
+                             [self.podcast_id])
+
+    def test_pending_marker(self):
+        fetched = threading.Event()
+        def slow_feed(headers):
+            fetched.wait(5)
+            return (200, RSS_HEADERS, rss_feed())
+        self.server.routes['/feed'] = slow_feed
+        view = self.controller.view = _MenuView(self.controller)
+        thread = self.controller.update_podcasts_async()
+        self.assertTrue(self.controller.is_refresh_pending(self.podcast_id))
+        self.controller.all_podcasts()
+        self.assertIn('[~]', view._io.lines[-1])
+        fetched.set()
+        thread.join(5)
+        self.assertFalse(self.controller.is_refresh_pending(self.podcast_id))
+        self.controller.all_podcasts()
+        self.assertIn('[X]', view._io.lines[-1])
+        self.assertNotIn('[~]', view._io.lines[-1])
+
+    def test_background_messages_deferred(self):
+        view = self.controller.view = _MenuView(self.controller)
+        self.controller.update_podcasts_async().join(5)
+        # nothing is printed over the prompt of the menu being shown
+        self.assertListEqual(view._io.lines, [])
+        self.controller.all_podcasts()
+        self.assertEqual(len(view._io.lines), 2)
+        self.assertEqual(view._io.lines[0], 'New episodes of "Foo"')
+        self.assertIn('[X]', view._io.lines[1])
+        view.update(start=True)
+        self.assertEqual(view._io.lines[-1], 'Updating Podcast Data...')
+
+
+class _PageView(object):
+    """View recording the pages of episodes listed"""
+    def episodes(self, podcast, episodes, cursors):
+        return ([episode.title for episode in episodes], cursors)
+
+
+class EpisodePagesTests(ControllerTestCase):
+    def setUp(self):
+        super(EpisodePagesTests, self).setUp()
+        self.controller.view = _PageView()
+        self.update(_feed(25))
+
+    @staticmethod
+    def _titles(*inds):
+        return ['Episode %d' % ind for ind in inds]
+
+    def test_pages(self):
+        titles, (prev_end, next_start) = self.controller.episodes(self.podcast_id)
+        self.assertListEqual(titles, self._titles(*xrange(24, 14, -1)))
+        self.assertIsNone(prev_end)
+        titles, (prev_end, next_start) = self.controller.episodes(self.podcast_id,
+                                                                  start=next_start)
+        self.assertListEqual(titles, self._titles(*xrange(14, 4, -1)))
+        titles, (prev_end, next_start) = self.controller.episodes(self.podcast_id,
+                                                                  start=next_start)
+        self.assertListEqual(titles, self._titles(*xrange(4, -1, -1)))
+        self.assertIsNone(next_start)
+        # refreshing the page starts it from its first episode
+        self.assertListEqual(self.controller.episodes(self.podcast_id, start=prev_end)[0],
+                             titles)
+        titles, (prev_end, next_start) = self.controller.episodes(self.podcast_id,
+                                                                  end=prev_end)
+        self.assertListEqual(titles, self._titles(*xrange(14, 4, -1)))
+        titles, (prev_end, next_start) = self.controller.episodes(self.podcast_id,
+                                                                  end=prev_end)
+        self.assertListEqual(titles, self._titles(*xrange(24, 14, -1)))
+        self.assertIsNone(prev_end)
+
+    def test_previous_page_short(self):
+        _, (_, next_start) = self.controller.episodes(self.podcast_id)
+        with self.controller.session() as session:
+            session.query(Episode).filter_by(title='Episode 24').delete()
+        # the first page is filled rather than left short
+        titles, (prev_end, _) = self.controller.episodes(self.podcast_id, end=next_start)
+        self.assertListEqual(titles, self._titles(*xrange(23, 13, -1)))
+        self.assertIsNone(prev_end)
+
+    def test_no_count(self):
+        _, (_, next_start) = self.controller.episodes(self.podcast_id)
+        with count_queries(self.controller._engine) as statements:
+            self.controller.episodes(self.podcast_id, start=next_start)
+        self.assertFalse(any('count(' in statement.lower() for statement in statements))
+
+
+class _RenderingView(ASCIIView):
+    """View rendering each menu without waiting for a choice"""
+    def _menu_action(self, page_text, actions):
+        self.page_text = page_text
+
+
+class ViewQueryTests(ControllerTestCase):
+    """Check that listing episodes takes a fixed number of statements
+    however many episodes are listed (i.e. no lazy load per episode)
+    """
+    def setUp(self):
+        super(ViewQueryTests, self).setUp()
+        self.controller.view = _RenderingView(self.controller)
+        self.update(_feed(10))
+        with self.controller.session() as session:
+            for episode in session.query(Episode):
+                episode.local_file = EpisodeFile(uri='file:///%d' % episode.id)
+
+    def test_episodes(self):
+        with assert_max_queries(self, self.controller._engine, 3):
+            self.controller.episodes(self.podcast_id)
+        self.assertIn('[X]', self.controller.view.page_text)
+
+    def test_downloaded_episodes(self):
+        with assert_max_queries(self, self.controller._engine, 1):
+            self.controller.downloaded_episodes()
+        self.assertIn('Episode 9', self.controller.view.page_text)
+
+
+class EpisodeStateTests(ControllerTestCase):
+    controller_args = {'position_interval': 3600}
+
+    def setUp(self):
+        super(EpisodeStateTests, self).setUp()
+        self.episode_id = self.add_episode('Episode 0')
+
+    def test_buffered(self):
+        with count_queries(self.controller._engine) as statements:
+            for position in xrange(100):
+                self.controller.update_episode_state(self.episode_id, position, 120)
+        self.assertListEqual(statements, [])
+        self.controller.save_episode_state()
+        with self.controller.session() as session:
+            episode = session.query(Episode).get(self.episode_id)
+            self.assertEqual(episode.last_position, 99)
+            self.assertEqual(session.query(Podcast).one().playback_rate, 120)
+
+
+    def test_saved_within_session(self):
+        self.controller.update_episode_state(self.episode_id, 5, 120)
+        with self.controller.session() as session:
+            session.query(Podcast).one().name = 'Bar'
+            self.controller._positions.flush()
+            # neither the caller's changes nor the states are committed
+            session.rollback()
+        with self.controller.session() as session:
+            self.assertEqual(session.query(Podcast).one().name, 'Foo')
+            self.assertIsNone(session.query(Episode).get(self.episode_id).last_position)
+
+    def test_controller_collected(self):
+        controller = Controller()
+        controller.update_episode_state(self.episode_id, 5, 120)
+        ref = weakref.ref(controller)
+        del controller
+        gc.collect()
+        self.assertIsNone(ref())
+
+class DownloadQueueTests(ControllerTestCase):
+    controller_args = {'db_fname': 'test.db'}
+
+    def setUp(self):
+        super(DownloadQueueTests, self).setUp()
+        self.server = LocalHTTPServer({'/1.mp3': (200, {}, 'one'), '/2.mp3': (200, {}, 'two')})
+        self.server.__enter__()
+        self.episode_ids = [self.add_episode(path, self.server.url(path))
+                            for path in ('/1.mp3', '/2.mp3', '/missing.mp3')]
+
+    def tearDown(self):
+        self.controller._downloads.stop()
+        default_client.close()
+        self.server.__exit__(None, None, None)
+        super(DownloadQueueTests, self).tearDown()
+
+    def test_queue_download(self):
+        progress = []
+        tickets = [self.controller.queue_download(id_, cb_progress=progress.append)
+                    for id_ in self.episode_ids[:2]]
+        for ticket in tickets:
+            self.assertIsNone(ticket.wait(5))
+        self.assertIn(1., progress)
+        with self.controller.session() as session:
+            self.assertEqual(session.query(Download).count(), 0)
+            self.assertEqual(session.query(EpisodeFile).count(), 2)
+            path = self.controller._store.get_path(self.controller._episode_key(self.episode_ids[0]))
+        with open(path) as local_file:
+            self.assertEqual(local_file.read(), 'one')
+
+    def test_failed_download_kept(self):
+        error = self.controller.queue_download(self.episode_ids[2]).wait(5)
+        self.assertIsNotNone(error)
+        with self.controller.session() as session:
+            download = session.query(Download).one()
+            self.assertEqual(download.episode_id, self.episode_ids[2])
+            self.assertEqual(download.error, error)
+
+    def test_worker_recovers(self):
+        # a single worker so that the download after the failure is on its thread
+        self.controller._downloads.stop()
+        self.controller._downloads = DownloadManager(self.controller._download_queued, 1)
+        ingest = self.controller._store.ingest
+        def fail_once(key, path):
+            self.controller._store.ingest = ingest
+            raise OSError('disk full')
+        self.controller._store.ingest = fail_once
+        self.assertIsNotNone(self.controller.queue_download(self.episode_ids[0]).wait(5))
+        self.assertIsNone(self.controller.queue_download(self.episode_ids[1]).wait(5))
+        with self.controller.session() as session:
+            self.assertListEqual([id_ for id_, in session.query(EpisodeFile.episode_id)],
+                                 self.episode_ids[1:2])
+            self.assertListEqual([id_ for id_, in session.query(Download.episode_id)],
+                                 self.episode_ids[:1])
+
+    def test_deleted_episode(self):
+        with self.controller.session() as session:
+            session.delete(session.query(Episode).get(self.episode_ids[0]))
+        self.assertEqual(self.controller.download_episode(self.episode_ids[0]),
+                         'Episode no longer exists')
+
+    def test_resume_downloads(self):
+        with self.controller.session() as session:
+            session.add(Download(episode_id=self.episode_ids[0], priority=0))
+        tickets = self.controller.resume_downloads()
+        self.assertEqual(len(tickets), 1)
+        self.assertIsNone(tickets[0].wait(5))
+        with self.controller.session() as session:
+            self.assertEqual(session.query(Download).count(), 0)
+            self.assertEqual(session.query(EpisodeFile).count(), 1)
+
+    def test_prefetch(self):
+        with self.controller.session() as session:
+            episodes = [session.query(Episode).get(id_) for id_ in self.episode_ids]
+            for ind, episode in enumerate(episodes):
+                episode.date_published = datetime(2015, 1, 1 + ind)
+            # the newest episode has been played
+            episodes[2].last_position = 10
+        tickets = self.controller.set_prefetch_count(episodes[0].podcast_id, 1)
+        self.assertListEqual([ticket.episode_id for ticket in tickets], self.episode_ids[1:2])
+        self.assertIsNone(tickets[0].wait(5))
+        with self.controller.session() as session:
+            self.assertEqual(session.query(Download).count(), 0)
+            podcast = session.query(Podcast).one()
+            self.assertEqual(podcast.prefetch_count, 1)
+            # nothing more is queued once the newest unplayed episode is downloaded
+            self.assertListEqual(self.controller._prefetch(podcast), [])
+
+
+class _StartedTicket(object):
+    def is_started(self):
+        return True
+
+
+class StreamingTests(ControllerTestCase):
+    controller_args = {'download_segments': 4}
+
+    def test_marked_before_ticket_checked(self):
+        def ticket(episode_id):
+            # a download started from now on is written in order
+            self.assertIn(episode_id, self.controller._streaming)
+            return None
+        self.controller._downloads.ticket = ticket
+        self.assertTrue(self.controller._can_stream(1))
+
+    def test_segmented_download_started(self):
+        self.controller._downloads.ticket = lambda episode_id: _StartedTicket()
+        self.assertFalse(self.controller._can_stream(1))
+        self.assertNotIn(1, self.controller._streaming)
+
+
+class QuotaTests(ControllerTestCase):
+    controller_args = {'quota': 10}
+
+    def setUp(self):
+        super(QuotaTests, self).setUp()
+        self.episode_ids = [self.add_episode(str(ind)) for ind in xrange(4)]
+
+    def _store(self, episode_id, size, last_played=None, enforce=True):
+        """Store a file of `size` bytes for the episode"""
+        with self.controller.session() as session:
+            episode = session.query(Episode).get(episode_id)
+            episode.last_played = last_played
+            key = self.controller._episode_key(episode_id)
+            self.controller._store.put(key, 'x' * size)
+            episode.local_file = EpisodeFile(episode_id=episode_id, size=size,
+                                             uri='file://' + self.controller._store.get_path(key))
+            self.controller._account(size)
+            if enforce:
+                self.controller._enforce_quota(keep=[episode_id])
+
+    def _stored(self):
+        with self.controller.session() as session:
+            return set(id_ for id_, in session.query(EpisodeFile.episode_id))
+
+    def test_under_quota(self):
+        self._store(self.episode_ids[0], 4)
+        self._store(self.episode_ids[1], 6)
+        self.assertSetEqual(self._stored(), set(self.episode_ids[:2]))
+
+    def test_evict_played_first(self):
+        self._store(self.episode_ids[0], 4)
+        self._store(self.episode_ids[1], 4, last_played=datetime(2015, 1, 2))
+        self._store(self.episode_ids[2], 1, last_played=datetime(2015, 1, 1))
+        self._store(self.episode_ids[3], 4)
+        # the least recently played episodes are evicted until the quota is met
+        self.assertSetEqual(self._stored(), set([self.episode_ids[0], self.episode_ids[3]]))
+        self.assertEqual(self.controller._stored_bytes, 8)
+
+    def test_evict_unplayed(self):
+        self._store(self.episode_ids[0], 6)
+        self._store(self.episode_ids[1], 6)
+        self.assertSetEqual(self._stored(), set([self.episode_ids[1]]))
+        with self.controller.session() as session:
+            self.assertFalse(os.path.exists(self.controller._store._key_to_path(
+                    self.controller._episode_key(self.episode_ids[0]))))
+
+    def test_accounting_loaded(self):
+        self._store(self.episode_ids[0], 6)
+        self.controller._stored_bytes = None
+        self._store(self.episode_ids[1], 6)
+        self.assertSetEqual(self._stored(), set([self.episode_ids[1]]))
+
+    def test_evicted_not_prefetched(self):
+        self._store(self.episode_ids[0], 6)
+        self._store(self.episode_ids[1], 6)
+        with self.controller.session() as session:
+            for ind, episode_id in enumerate(self.episode_ids):
+                session.query(Episode).get(episode_id).date_published = datetime(2015, 1, 1 + ind)
+            # played, though its position is yet to be saved
+            session.query(Episode).get(self.episode_ids[3]).last_played = datetime(2015, 2, 1)
+            podcast = session.query(Podcast).get(self.podcast_id)
+            podcast.prefetch_count = 4
+            self.controller.queue_download = lambda episode_id, priority: episode_id
+            # neither the episode evicted to make room nor the played one is queued
+            self.assertListEqual(self.controller._prefetch(podcast), [self.episode_ids[2]])
+        with self.controller.session() as session:
+            # remembered across runs
+            self.assertIsNotNone(session.query(Episode).get(self.episode_ids[0]).date_evicted)
+
+    def test_concurrent_eviction(self):
+        self.controller._stored_bytes = 0
+        for episode_id in self.episode_ids[:3]:
+            self._store(episode_id, 6, enforce=False)
+        def enforce():
+            with self.controller.session():
+                self.controller._enforce_quota()
+        threads = [threading.Thread(target=enforce) for _ in xrange(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        # the two oldest files are evicted once
+        self.assertSetEqual(self._stored(), set(self.episode_ids[2:3]))
+        self.assertEqual(self.controller._stored_bytes, 6)
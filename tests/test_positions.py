@@ -0,0 +1,53 @@
+"""Tests for the write-behind playback position buffer
+"""
+from podcaster.positions import PositionTracker
+
+import unittest
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class PositionTrackerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        self.persisted = []
+        self.tracker = PositionTracker(self.persisted.append, interval=30, clock=self.clock)
+
+    def test_coalesced(self):
+        for position in xrange(10):
+            self.clock.now += 1
+            self.tracker.update(1, position, 1.)
+        self.assertListEqual(self.persisted, [])
+        self.tracker.flush()
+        self.assertListEqual(self.persisted, [{1: (9, 1.)}])
+
+    def test_interval(self):
+        for position in xrange(100):
+            self.clock.now += 1
+            self.tracker.update(1, position, 1.)
+        self.assertListEqual(self.persisted, [{1: (29, 1.)}, {1: (59, 1.)}, {1: (89, 1.)}])
+
+    def test_unchanged_not_persisted(self):
+        self.tracker.update(1, 5, 1.)
+        self.tracker.flush()
+        # e.g. while paused
+        self.tracker.update(1, 5, 1.)
+        self.tracker.flush()
+        self.assertListEqual(self.persisted, [{1: (5, 1.)}])
+
+    def test_failed_persist_kept(self):
+        def fail(states):
+            raise IOError('disk full')
+        tracker = PositionTracker(fail, clock=self.clock)
+        tracker.update(1, 5, 1.)
+        self.assertRaises(IOError, tracker.flush)
+        tracker._persist = self.persisted.append
+        tracker.flush()
+        self.assertListEqual(self.persisted, [{1: (5, 1.)}])
+
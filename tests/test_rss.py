@@ -0,0 +1,68 @@
+"""Tests for the resolution of feeds
+"""
+from podcaster.http import default_client
+from podcaster.rss import get_podcast
+from tests.utils import LocalHTTPServer, rss_feed, RSS_HEADERS
+
+from collections import Counter
+import unittest
+
+
+_HTML_HEADERS = {'Content-Type': 'text/html'}
+
+
+def _page(head):
+    return '<html><head>%s</head><body></body></html>' % head
+
+
+class GetPodcastTests(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalHTTPServer({
+                '/page': (200, _HTML_HEADERS,
+                          _page('<link rel="alternate" type="application/rss+xml" '
+                                'href="/feed">')),
+                '/redirect': (200, _HTML_HEADERS,
+                              _page('<meta http-equiv="refresh" content="0; url=/page">')),
+                '/loop': (200, _HTML_HEADERS,
+                          _page('<meta http-equiv="refresh" content="0; url=/loop">')),
+                '/feed': (200, RSS_HEADERS, rss_feed()),
+                '/moved': (301, {'Location': '/page'}, ''),
+            })
+        self.server.__enter__()
+
+    def tearDown(self):
+        default_client.close()
+        self.server.__exit__(None, None, None)
+
+    def _fetches(self):
+        """Return a Counter of the number of requests made for each path"""
+        return Counter(path for path, _ in self.server.requests)
+
+    def test_rss_link(self):
+        podcast_data, episode_iter = get_podcast(self.server.url('/redirect'))
+        self.assertEqual(podcast_data.title, 'Foo')
+        self.assertEqual(podcast_data.rss_url, self.server.url('/feed'))
+        self.assertTupleEqual(podcast_data.chain, tuple(self.server.url(path) for path in
+                                                        ('/redirect', '/page', '/feed')))
+        self.assertEqual(len(list(episode_iter)), 2)
+        # each URL is fetched once for both parsing and discovery
+        self.assertDictEqual(self._fetches(), {'/redirect': 1, '/page': 1, '/feed': 1})
+
+    def test_http_redirect(self):
+        podcast_data, _ = get_podcast(self.server.url('/moved'))
+        self.assertEqual(podcast_data.rss_url, self.server.url('/feed'))
+        # HTTP redirects are recorded along with the hops found in pages
+        self.assertTupleEqual(podcast_data.chain, tuple(self.server.url(path) for path in
+                                                        ('/moved', '/page', '/feed')))
+        self.assertDictEqual(self._fetches(), {'/moved': 1, '/page': 1, '/feed': 1})
+
+    def test_meta_redirect_cycle(self):
+        podcast_data, episode_iter = get_podcast(self.server.url('/loop'))
+        self.assertIsNone(podcast_data)
+        self.assertListEqual(list(episode_iter), [])
+        self.assertDictEqual(self._fetches(), {'/loop': 1})
+
+    def test_no_discovery(self):
+        podcast_data, _ = get_podcast(self.server.url('/page'), discover=False)
+        self.assertIsNone(podcast_data)
+        self.assertDictEqual(self._fetches(), {'/page': 1})
@@ -0,0 +1,58 @@
+"""Tests for the adaptive refresh scheduler
+"""
+from podcaster.schedule import RefreshScheduler
+
+import unittest
+from datetime import datetime, timedelta
+
+
+class RefreshSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RefreshScheduler(min_interval=timedelta(hours=1),
+                                          max_interval=timedelta(days=7),
+                                          default_interval=timedelta(days=1),
+                                          poll_fraction=.5, jitter=0)
+        self.now = datetime(2015, 6, 1)
+
+    def _dates(self, step, num=10, last=None):
+        last = last or self.now
+        return [last - ind * step for ind in xrange(num)]
+
+    def test_cadence(self):
+        self.assertEqual(self.scheduler.cadence(self._dates(timedelta(days=2))),
+                         timedelta(days=2))
+        self.assertIsNone(self.scheduler.cadence(self._dates(timedelta(days=2), num=1)))
+
+    def test_cadence_median(self):
+        dates = self._dates(timedelta(days=1), num=5) + [self.now - timedelta(days=300)]
+        self.assertEqual(self.scheduler.cadence(dates), timedelta(days=1))
+
+    def test_interval(self):
+        interval = self.scheduler.interval(self._dates(timedelta(days=2)), now=self.now)
+        self.assertEqual(interval, timedelta(days=1))
+
+    def test_no_history(self):
+        self.assertEqual(self.scheduler.interval([], now=self.now), timedelta(hours=12))
+
+    def test_bounds(self):
+        hourly = self._dates(timedelta(minutes=10))
+        self.assertEqual(self.scheduler.interval(hourly, now=self.now), timedelta(hours=1))
+        yearly = self._dates(timedelta(days=365))
+        self.assertEqual(self.scheduler.interval(yearly, now=self.now), timedelta(days=7))
+
+    def test_dormant(self):
+        dates = self._dates(timedelta(hours=4), last=self.now - timedelta(days=4))
+        self.assertEqual(self.scheduler.interval(dates, now=self.now), timedelta(days=2))
+
+    def test_cache_lifetime(self):
+        dates = self._dates(timedelta(hours=4))
+        interval = self.scheduler.interval(dates, cache_lifetime=6 * 3600, now=self.now)
+        self.assertEqual(interval, timedelta(hours=6))
+
+    def test_jitter(self):
+        self.scheduler.jitter = .1
+        dates = self._dates(timedelta(days=2))
+        for _ in xrange(20):
+            delay = self.scheduler.next_check(dates, now=self.now) - self.now
+            self.assertGreaterEqual(delay, timedelta(days=.9))
+            self.assertLessEqual(delay, timedelta(days=1.1))
@@ -5,7 +5,9 @@ from podcaster.store import SimpleFileStore, InitializationError
 from tests.utils import TempDir
 
 import unittest
+import json
 import os
+import stat
 import datetime
 from datetime import datetime, timedelta
 from dateutil.tz import tzutc
@@ -118,6 +120,15 @@ class SimpleFileStoreTests(unittest.TestCase):
         dummy = SimpleFileStore(self._store_dir)
         self.assertTrue(not dummy.exists('k'))
 
+    def test_partial_path(self):
+        path = self.store.partial_path('k')
+        with open(path, 'w') as partial:
+            partial.write('v')
+        self.assertFalse(self.store.exists('k'))
+        self.store.save()
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertEqual(open(dummy.partial_path('k')).read(), 'v')
+
     def test_date_added(self):
         expected = datetime.now(tzutc())
         self.store.put('k', 'v')
@@ -165,8 +176,205 @@ class SimpleFileStoreTests(unittest.TestCase):
         dummy = SimpleFileStore(self._store_dir)
         self.assertEqual(open(dummy.get_path('k')).read(), 'v')
 
+    def test_ingest(self):
+        path = self.store.partial_path('k')
+        with open(path, 'w') as partial:
+            partial.write('v')
+        self.store.ingest('k', path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(open(self.store.get_path('k')).read(), 'v')
+        self.store.save()
+
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertEqual(open(dummy.get_path('k')).read(), 'v')
+
     def test_put_bad_file(self):
         with self.assertRaises(IOError):
             with open('foo', 'w') as file_:
                 file_.write('v')
                 self.store.put('k', file_)
+        self.assertFalse(self.store.exists('k'))
+        self.assertItemsEqual(os.listdir(self._store_dir), [SimpleFileStore._MANIFEST_FNAME])
+
+    def test_sharded_layout(self):
+        self.store.put('k', 'v')
+        digest = '13fbd79c3d390e5d6585a21e11ff5ec1970cff0c'
+        self.assertEqual(self.store.get_path('k'),
+                         os.path.join(os.path.abspath(self._store_dir), '13', 'fb', digest))
+
+    def test_validate_nested(self):
+        self.store.put('k', 'v')
+        self.store.save()
+        garbage_fname = os.path.join(os.path.dirname(self.store.get_path('k')), 'foo')
+        open(garbage_fname, 'w').close()
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertFalse(os.path.exists(garbage_fname))
+        self.assertTrue(dummy.exists('k'))
+
+    def test_no_validate(self):
+        self.store.put('k1', 'v')
+        self.store.put('k2', 'v')
+        self.store.save()
+        garbage_fname = os.path.join(self._store_dir, 'foo')
+        open(garbage_fname, 'w').close()
+        os.remove(self.store.get_path('k1'))
+        dummy = SimpleFileStore(self._store_dir, validate=False)
+        self.assertTrue(os.path.exists(garbage_fname))
+        self.assertSetEqual(set(dummy.keys()), set(['k1', 'k2']))
+
+    def test_scrub(self):
+        self.store.put('k1', 'v')
+        self.store.put('k2', 'v')
+        self.store.save()
+        garbage_fnames = [os.path.join(self._store_dir, 'foo'),
+                          os.path.join(os.path.dirname(self.store.get_path('k2')), 'foo')]
+        for garbage_fname in garbage_fnames:
+            open(garbage_fname, 'w').close()
+        os.remove(self.store.get_path('k1'))
+        dummy = SimpleFileStore(self._store_dir, validate=False)
+        self.assertFalse(dummy.scrub(batch=200))
+        # the position of the scrub persists across runs
+        dummy = SimpleFileStore(self._store_dir, validate=False)
+        self.assertTrue(dummy.scrub(batch=200))
+        self.assertFalse(any(os.path.exists(fname) for fname in garbage_fnames))
+        self.assertSetEqual(set(dummy.keys()), set(['k2']))
+        dummy = SimpleFileStore(self._store_dir, validate=False)
+        self.assertSetEqual(set(dummy.keys()), set(['k2']))
+
+
+class JournaledManifestTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self._store_dir = 'dir'
+        self._manifest_path = os.path.join(self._store_dir, SimpleFileStore._MANIFEST_FNAME)
+        self._journal_path = os.path.join(self._store_dir, SimpleFileStore._JOURNAL_FNAME)
+        self.store = SimpleFileStore(self._store_dir)
+
+    def tearDown(self):
+        self._temp_dir.exit()
+
+    def test_save_appends(self):
+        snapshot = open(self._manifest_path).read()
+        self.store.put('k1', 'v')
+        self.store.save()
+        self.store.put('k2', 'v')
+        self.store.remove('k1')
+        self.store.save()
+        self.assertEqual(open(self._manifest_path).read(), snapshot)
+        self.assertEqual(len(open(self._journal_path).readlines()), 3)
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k2']))
+        self.assertEqual(dummy.get_date_added('k2'), self.store.get_date_added('k2'))
+
+    def test_compact(self):
+        self.store.COMPACT_MIN = 2
+        for key in ('k1', 'k2', 'k3'):
+            self.store.put(key, 'v')
+            self.store.save()
+        self.assertFalse(os.path.exists(self._journal_path))
+        with open(self._manifest_path) as manifest:
+            self.assertSetEqual(set(json.load(manifest).keys()), set(['k1', 'k2', 'k3']))
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k1', 'k2', 'k3']))
+
+    def test_torn_record(self):
+        self.store.put('k1', 'v')
+        self.store.save()
+        self.store.put('k2', 'v')
+        self.store.save()
+        with open(self._journal_path) as journal:
+            records = journal.read()
+        with open(self._journal_path, 'w') as journal:
+            journal.write(records[:-10])
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k1']))
+
+    def test_torn_record_repaired(self):
+        self.store.put('k1', 'v')
+        self.store.save()
+        self.store.put('k2', 'v')
+        self.store.save()
+        with open(self._journal_path) as journal:
+            records = journal.read()
+        with open(self._journal_path, 'w') as journal:
+            journal.write(records[:-10])
+        dummy = SimpleFileStore(self._store_dir)
+        dummy.put('k3', 'v3')
+        dummy.save()
+        dummy.put('k4', 'v4')
+        dummy.save()
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k1', 'k3', 'k4']))
+        for key in ('k3', 'k4'):
+            self.assertEqual(open(dummy.get_path(key)).read(), 'v' + key[1])
+
+    def test_corrupted_record_skipped(self):
+        self.store.put('k1', 'v')
+        self.store.save()
+        with open(self._journal_path, 'a') as journal:
+            journal.write('garbage\n')
+        self.store.put('k2', 'v')
+        self.store.save()
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k1', 'k2']))
+
+    def test_compact_keeps_mode(self):
+        os.chmod(self._manifest_path, 0644)
+        self.store.put('k1', 'v')
+        self.store.compact()
+        self.assertEqual(stat.S_IMODE(os.stat(self._manifest_path).st_mode), 0644)
+
+    def test_replay_after_compaction(self):
+        self.store.put('k1', 'v')
+        self.store.save()
+        with open(self._journal_path) as journal:
+            records = journal.read()
+        self.store.compact()
+        # as if the process died before the journal was emptied
+        with open(self._journal_path, 'w') as journal:
+            journal.write(records)
+        dummy = SimpleFileStore(self._store_dir)
+        self.assertSetEqual(set(dummy.keys()), set(['k1']))
+
+
+class DedupeFileStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self._store_dir = 'dir'
+        self.store = SimpleFileStore(self._store_dir, dedupe=True)
+
+    def tearDown(self):
+        self._temp_dir.exit()
+
+    def _objects(self):
+        objects_dir = os.path.join(self._store_dir, SimpleFileStore._OBJECTS_DIRNAME)
+        return [fname for _, _, fnames in os.walk(objects_dir) for fname in fnames]
+
+    def test_dedupe(self):
+        self.store.put('k1', 'v')
+        self.store.put('k2', 'v')
+        self.assertTrue(os.path.samefile(self.store.get_path('k1'), self.store.get_path('k2')))
+        self.assertEqual(len(self._objects()), 1)
+        self.store.remove('k1')
+        self.assertEqual(open(self.store.get_path('k2')).read(), 'v')
+        self.assertEqual(len(self._objects()), 1)
+        self.store.remove('k2')
+        self.assertListEqual(self._objects(), [])
+
+    def test_put_twice(self):
+        self.store.put('k', 'v1')
+        self.store.put('k', 'v2')
+        self.assertEqual(open(self.store.get_path('k')).read(), 'v2')
+        self.assertEqual(len(self._objects()), 1)
+
+    def test_validate(self):
+        self.store.put('k1', 'v')
+        self.store.put('k2', 'v')
+        self.store.save()
+        os.remove(self.store.get_path('k1'))
+        os.remove(self.store.get_path('k2'))
+        SimpleFileStore(self._store_dir, dedupe=True)
+        self.assertListEqual(self._objects(), [])
+
@@ -0,0 +1,57 @@
+"""Tests for serving partial downloads
+"""
+from podcaster.stream import PartialFile, LoopbackServer
+from tests.utils import TempDir
+
+import threading
+import time
+import unittest
+from urllib2 import urlopen, Request
+
+
+class PartialFileTests(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self.complete = threading.Event()
+        self.partial = open('partial', 'wb')
+        self.partial.write('abc')
+        self.partial.flush()
+
+    def tearDown(self):
+        self.partial.close()
+        self._temp_dir.exit()
+
+    def _append_later(self, data, complete=True):
+        """Append `data` to the partial file after a short delay"""
+        def append():
+            time.sleep(.2)
+            self.partial.write(data)
+            self.partial.flush()
+            if complete:
+                self.complete.set()
+        thread = threading.Thread(target=append)
+        thread.start()
+        return thread
+
+    def test_read_blocks(self):
+        with PartialFile('partial', self.complete.is_set, poll_interval=.01) as partial_file:
+            self.assertEqual(partial_file.read(0, 10), 'abc')
+            thread = self._append_later('def')
+            self.assertEqual(partial_file.read(3, 10), 'def')
+            thread.join()
+            self.assertEqual(partial_file.read(6, 10), '')
+
+    def test_serve(self):
+        partial_file = PartialFile('partial', self.complete.is_set, 6, poll_interval=.01)
+        with LoopbackServer(partial_file) as server:
+            thread = self._append_later('def')
+            response = urlopen(server.url)
+            self.assertEqual(response.info()['content-length'], '6')
+            self.assertEqual(response.read(), 'abcdef')
+            thread.join()
+            response = urlopen(Request(server.url, headers={'Range': 'bytes=2-'}))
+            self.assertEqual(response.getcode(), 206)
+            self.assertEqual(response.info()['content-range'], 'bytes 2-5/6')
+            self.assertEqual(response.read(), 'cdef')
+
@@ -1,8 +1,16 @@
 """Utilities for testing
 """
+from podcaster.stream import ThreadingHTTPServer
+
+from BaseHTTPServer import BaseHTTPRequestHandler
 from contextlib import contextmanager
+from datetime import datetime
 from random import randint
 import os
+import threading
+import unittest
+
+from sqlalchemy import event
 
 
 @contextmanager
@@ -18,6 +26,40 @@ def chdir(path):
     os.chdir(last_dir)
 
 
+@contextmanager
+def count_queries(engine):
+    """Yield a list that collects the SQL statements executed on `engine`
+    while the context is active.
+
+    engine - the SQLAlchemy engine to be monitored
+    """
+    statements = []
+    def cb_execute(conn, cursor, statement, parameters, context, executemany):
+        """Record each statement sent to the DBAPI cursor"""
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', cb_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', cb_execute)
+
+
+@contextmanager
+def assert_max_queries(test_case, engine, limit):
+    """Fail `test_case` if more than `limit` SQL statements are executed on
+    `engine` while the context is active (e.g. a lazy load per row)
+
+    test_case - the TestCase making the assertion
+    engine - the SQLAlchemy engine to be monitored
+    limit - the maximum number of statements expected
+    """
+    with count_queries(engine) as statements:
+        yield statements
+    test_case.assertLessEqual(len(statements), limit,
+                              'Expected at most %d statements, got %d:\n%s' %
+                              (limit, len(statements), '\n'.join(statements)))
+
+
 def _remove_all(path):
     """Removes all files and directories beneath (but not including) `path`
     """
@@ -119,3 +161,129 @@ class TempDir(object):
             with TempDir(*args, **kwargs):
                 return func(*fargs, **fkwargs)
         return _with_temp_dir
+
+
+class ControllerTestCase(unittest.TestCase):
+    """Test case run in a temporary directory against a `Controller` holding
+    a single podcast (whose id is `podcast_id`)
+
+    controller_args - the keyword arguments with which the `Controller` is created
+    """
+    controller_args = {}
+
+    def setUp(self):
+        # imported here so that tests not needing a Controller (and so a
+        # player) can use the rest of this module
+        from podcaster.model import Podcast
+        from podcaster.operations import Controller
+        self._temp_dir = TempDir()
+        self._temp_dir.enter()
+        self.controller = Controller(**self.controller_args)
+        with self.controller.session() as session:
+            podcast = Podcast(name='Foo', rss_url='http://example.com/rss',
+                                last_updated=datetime(2000, 1, 1))
+            session.add(podcast)
+            session.flush()
+            self.podcast_id = podcast.id
+
+    def tearDown(self):
+        self._temp_dir.exit()
+
+    def update(self, feed):
+        """Apply `feed`, a 2-tuple of the form (podcast_data, episode_tuples),
+        to the podcast
+        """
+        from podcaster.model import Podcast
+        with self.controller.session() as session:
+            podcast = session.query(Podcast).get(self.podcast_id)
+            self.controller._update_podcast(podcast, *feed)
+
+    def add_episode(self, title, url=''):
+        """Add an episode to the podcast and return its id
+        """
+        from podcaster.model import Episode
+        with self.controller.session() as session:
+            episode = Episode(podcast_id=self.podcast_id, title=title, url=url)
+            session.add(episode)
+            session.flush()
+            return episode.id
+
+
+# The headers with which `rss_feed` should be served
+RSS_HEADERS = {'Content-Type': 'application/rss+xml'}
+
+
+def rss_feed(title='Foo', num_episodes=2, updated='Mon, 01 Jun 2015 00:00:00 GMT'):
+    """Return the XML of an RSS feed with `num_episodes` audio episodes (to be
+    served with `RSS_HEADERS`)
+    """
+    items = ''.join('<item><title>Episode %d</title><pubDate>%s</pubDate>'
+                    '<enclosure url="http://example.com/%d.mp3" type="audio/mpeg"/></item>' %
+                    (ind, 'Mon, %02d Jun 2015 00:00:00 GMT' % (ind + 1), ind)
+                    for ind in xrange(num_episodes))
+    return ('<?xml version="1.0"?><rss version="2.0"><channel><title>%s</title>'
+            '<lastBuildDate>%s</lastBuildDate>%s</channel></rss>' % (title, updated, items))
+
+
+class LocalHTTPServer(object):
+    """Context manager class serving canned HTTP/1.1 responses from a local
+    server running on a background thread.
+
+    routes - a dict mapping request paths to either a 3-tuple of the form
+        (status, headers_dict, body) or a function accepting the dict of
+        request headers and returning such a tuple. A Content-Length header
+        is added unless one is provided.
+
+    After use, `requests` contains a (path, request_headers) 2-tuple for each
+    request received and `connections` the number of connections accepted.
+    """
+    def __init__(self, routes=None):
+        self.routes = routes if routes is not None else {}
+        self.requests = []
+        self.connections = 0
+        self._server = None
+
+    def _handler_cls(self):
+        """Return a request handler class bound to this instance
+        """
+        local_server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                local_server.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                headers = dict(self.headers)
+                local_server.requests.append((self.path, headers))
+                route = local_server.routes.get(self.path, (404, {}, ''))
+                status, response_headers, body = route(headers) if callable(route) else route
+                self.send_response(status)
+                for name, value in response_headers.iteritems():
+                    self.send_header(name, value)
+                if 'Content-Length' not in response_headers:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
+
+    def url(self, path):
+        """Return the URL of `path` on the server
+        """
+        return 'http://%s:%d%s' % (self._server.server_address + (path,))
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_cls())
+        thread = threading.Thread(target=self._server.serve_forever, args=(.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None